@@ -6,7 +6,9 @@
 
 import os
 import subprocess
-import csv
+
+import ni_helper
+import signal_analysis
 
 ENABLE_DEVICE = True
 
@@ -17,14 +19,17 @@ class NIAnalogInException(Exception):
 
 class NIAnalogIn(object):
     def __init__(self, ni_device_id=1, binary_path="niFreqCtr.exe", channel="AI0", sample_frequency=48000,
-                 tempfile="temp.csv"):
+                 tempfile="temp.csv", persistent=False, helper_command=None):
         self._dev = "Dev%d" % ni_device_id
         self._channel = channel
         self._sample_frequency = sample_frequency
         self._binary_path = binary_path
         self._is_debug_enabled = False
         self._tempfile = tempfile
-        if not os.path.isfile(binary_path):
+        # persistent: keep one --serve process running instead of starting the exe per acquisition
+        self._persistent = persistent
+        self._helper_command = helper_command
+        if helper_command is None and not os.path.isfile(binary_path):
             raise NIAnalogInException("Binary path does not exist.")
 
     def enable_debug(self, enable=True):
@@ -42,6 +47,17 @@ class NIAnalogIn(object):
     def acquire_samples(self, sample_time=1):
         if os.path.isfile(self._tempfile):
             os.remove(self._tempfile)
+        if self._persistent and ENABLE_DEVICE:
+            command = self._helper_command or [self._binary_path, ni_helper.HELPER_ARGUMENT]
+            try:
+                ni_helper.get_helper(command).request("acquire_samples", file=self._tempfile,
+                                                      channel=self._dev + "/" + self._channel,
+                                                      rate=self._sample_frequency, time=sample_time)
+            except ni_helper.NIHelperException as the_exception:
+                raise NIAnalogInException("Helper error: [%s]" % the_exception)
+            if not os.path.isfile(self._tempfile):
+                raise NIAnalogInException("Output File does not exist")
+            return 0
         call_string = (self._binary_path + " -f " + self._tempfile + " -x " + self._dev + "/" + self._channel + " -r " +
                        str(self._sample_frequency) + " -a " + str(sample_time))
         (output, exit_code) = self._dispatch(call_string)
@@ -53,19 +69,12 @@ class NIAnalogIn(object):
             return 0
 
     def find_duty(self, high_voltage=5.0):
-        sample_data = []
-        with open(self._tempfile, 'r') as samplefile:
-            sample_reader = csv.reader(samplefile, delimiter=',')
-            sample_reader.next()
-            for row in sample_reader:
-                sample_data.append([float(row[0]), float(row[1])])
-        value_array = [row[1] for row in sample_data]
-        dc_offset = min(value_array)
-        maximum_voltage = max(value_array) - dc_offset
+        minimum, maximum, mean = signal_analysis.summary(signal_analysis.load_csv_capture(self._tempfile))
+        maximum_voltage = maximum - minimum
         if maximum_voltage < 0.9 * high_voltage:
             raise NIAnalogInException("No high periods detected")
         else:
-            return sum(value_array) / (len(value_array) * maximum_voltage)
+            return mean / maximum_voltage
 
     def _dispatch(self, call_string):
 
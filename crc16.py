@@ -2,6 +2,8 @@
 #*              CRC-16 (reverse) table lookup for Modbus or DF1
 #*
 
+from itertools import izip
+
 INITIAL_MODBUS = 0xFFFF
 INITIAL_DF1 = 0x0000
 
@@ -39,6 +41,91 @@ POLYNOMIAL_TABLE = (0x0000, 0xC0C1, 0xC181, 0x0140, 0xC301, 0x03C0, 0x0280, 0xC2
                     0x8201, 0x42C0, 0x4380, 0x8341, 0x4100, 0x81C1, 0x8081, 0x4040)
 
 
+
+def _make_slice_tables(base_table, count):
+    # tables[k][i] is the CRC contribution of byte value i followed by k zero bytes.
+    tables = [tuple(base_table)]
+    for _ in range(count - 1):
+        previous = tables[-1]
+        tables.append(tuple((value >> 8) ^ base_table[value & 0xFF] for value in previous))
+    return tables
+
+# Slice-by-8: 8 bytes per loop iteration.  The CRC register only overlaps the first 2 of them.
+_SLICE_TABLES = _make_slice_tables(POLYNOMIAL_TABLE, 8)
+
+# calculate() works through its input in blocks of this many bytes (a multiple of 8), so memory use stays flat
+# however big the input is.
+_BLOCK_SIZE = 65536
+
+try:
+    # crcmod's C extension, if installed, is much faster than anything we can do in Python.
+    import crcmod
+    _crcmod_modbus = crcmod.mkCrcFun(0x18005, initCrc=0, rev=True, xorOut=0)
+except ImportError:
+    _crcmod_modbus = None
+
+
+def _calculate_python(data, accumulated_crc_value):
+    # data is a bytearray of at most _BLOCK_SIZE bytes.
+    t0, t1, t2, t3, t4, t5, t6, t7 = _SLICE_TABLES
+    crc = accumulated_crc_value
+    whole_length = len(data) - len(data) % 8
+    octets = iter(data if whole_length == len(data) else data[:whole_length])
+    for b0, b1, b2, b3, b4, b5, b6, b7 in izip(octets, octets, octets, octets, octets, octets, octets, octets):
+        crc ^= b0 | (b1 << 8)
+        crc = t7[crc & 0xFF] ^ t6[crc >> 8] ^ t5[b2] ^ t4[b3] ^ t3[b4] ^ t2[b5] ^ t1[b6] ^ t0[b7]
+    for byte in data[whole_length:]:
+        crc = (crc >> 8) ^ t0[(crc ^ byte) & 0xFF]
+    return crc
+
+
+def calculate(data, accumulated_crc_value=INITIAL_MODBUS):
+    """CRC-16 (Modbus/DF1 flavor) of str/bytes, bytearray or memoryview data."""
+    try:
+        view = memoryview(data)
+    except TypeError:
+        # e.g. a list of byte values
+        view = memoryview(bytearray(data))
+    crc = accumulated_crc_value
+    for start in xrange(0, len(view), _BLOCK_SIZE):
+        block = view[start:start + _BLOCK_SIZE]
+        if _crcmod_modbus is not None:
+            crc = _crcmod_modbus(block.tobytes(), crc)
+        else:
+            crc = _calculate_python(bytearray(block), crc)
+    return crc
+
+
+class Crc16(object):
+    """Streaming CRC-16 with a hashlib-like interface, for data too big to hold at once.
+
+        crc = crc16.Crc16()
+        for block in iter(lambda: log_file.read(65536), ''):
+            crc.update(block)
+        crc.value
+    """
+
+    digest_size = 2
+
+    def __init__(self, data=None, initial_value=INITIAL_MODBUS):
+        self.value = initial_value
+        if data is not None:
+            self.update(data)
+
+    def update(self, data):
+        self.value = calculate(data, self.value)
+
+    def copy(self):
+        return Crc16(initial_value=self.value)
+
+    def digest(self):
+        # Modbus sends the low byte first.
+        return chr(self.value & 0xFF) + chr(self.value >> 8)
+
+    def hexdigest(self):
+        return "%04x" % self.value
+
+
 def calculate_byte(input_byte, accumulated_crc_value=INITIAL_MODBUS):
     if isinstance(input_byte, str):
         byte = ord(input_byte)
@@ -52,11 +139,7 @@ def calculate_byte(input_byte, accumulated_crc_value=INITIAL_MODBUS):
 
 
 def calculate_string(input_string, accumulated_crc_value=INITIAL_MODBUS):
-    for input_char in input_string:
-        accumulated_crc_value = \
-            (accumulated_crc_value >> 8) ^ POLYNOMIAL_TABLE[(accumulated_crc_value ^ ord(input_char)) & 0xFF]
-
-    return accumulated_crc_value
+    return calculate(input_string, accumulated_crc_value)
 
 
 if __name__ == '__main__':
@@ -91,6 +174,15 @@ if __name__ == '__main__':
     else:
         print "Ok"
 
+    print "test case #4 (streaming, memoryview):",
+    _CRC = Crc16("\x4b\x03\x00")
+    _CRC.update(memoryview(bytearray("\x2c\x00\x37")))
+    if _CRC.value != 0xbfcb:
+        print "BAD - ERROR - FAILED! ",
+        print "expect:0xBFCB but saw 0x%x" % _CRC.value
+    else:
+        print "Ok"
+
     print
     print "testing DF1 messages with crc16.py"
 
@@ -40,7 +40,7 @@ $Author:  Don Peterson $
 '''
 
 from __future__ import division
-import sys, time, serial
+import array, struct, sys, time, serial
 from string import join
 try:
     from   win32com.server.exception import COMException
@@ -53,6 +53,13 @@ except:
 out = sys.stdout.write
 nl = "\n"
 
+# Python 2 has no time.monotonic; default_timer is the best clock there is
+# (QueryPerformanceCounter on Windows).
+try:
+    monotonic = time.monotonic
+except AttributeError:
+    from timeit import default_timer as monotonic
+
 class InstrumentException(Exception): pass
 
 class InstrumentInterface:
@@ -60,6 +67,7 @@ class InstrumentInterface:
     functions.
     '''
     debug = 0  # Set to 1 to see dumps of commands and responses
+    validate = 1  # Set to 0 to skip checking every outgoing command
     length_packet = 26  # Number of bytes in a packet
     convert_current = 1e4  # Convert current in A to 0.1 mA
     convert_voltage = 1e3  # Convert voltage in V to mV
@@ -71,9 +79,31 @@ class InstrumentInterface:
     highest_register = 25
     # Values for setting modes of CC, CV, CW, or CR
     modes = {"cc":0, "cv":1, "cw":2, "cr":3}
+    valid_commands = frozenset(range(0x20, 0x6D) + [0x12])
+    # Precompiled packet layouts.  Every packet is start byte, address,
+    # command, 22 bytes of little endian payload, checksum.
+    header_struct = struct.Struct("<BBB")
+    integer_structs = {1:struct.Struct("<B"), 2:struct.Struct("<H"), 4:struct.Struct("<I")}
+    integer_masks = {1:0xff, 2:0xffff, 4:0xffffffff}
+    payload_offset = 3
+    empty_payload = chr(0)*22
+    # Most packets TransactBatch sends before reading the responses.  Keeps
+    # the load's receive buffer from overflowing.
+    max_batch_packets = 25
+    # Status byte of a 0x12 response packet
+    responses = {
+        0x90 : "Wrong checksum",
+        0xA0 : "Incorrect parameter value",
+        0xB0 : "Command cannot be carried out",
+        0xC0 : "Invalid command",
+        0x80 : "",
+    }
     def Initialize(self, com_port, baudrate, address=0):
         self.sp = serial.Serial(com_port, baudrate)
         self.address = address
+        # Outgoing commands are packed into this buffer instead of building
+        # a new string for each one.
+        self.packet = bytearray(self.length_packet)
     def DumpCommand(self, bytes):
         '''Print out the contents of a 26 byte command.  Example:
             aa .. 20 01 ..   .. .. .. .. ..
@@ -81,6 +111,7 @@ class InstrumentInterface:
             .. .. .. .. ..   cb
         '''
         assert(len(bytes) == self.length_packet)
+        bytes = bytearray(bytes)
         header = " "*3
         out(header)
         for i in xrange(self.length_packet):
@@ -88,7 +119,7 @@ class InstrumentInterface:
                 out(nl + header)
             if i % 5 == 0:
                 out(" ")
-            s = "%02x" % ord(bytes[i])
+            s = "%02x" % bytes[i]
             if s == "00":
                 # Use the decimal point character if you see an
                 # unattractive printout on your machine.
@@ -101,37 +132,27 @@ class InstrumentInterface:
     def CommandProperlyFormed(self, cmd):
         '''Return 1 if a command is properly formed; otherwise, return 0.
         '''
-        commands = (
-            0x20, 0x21, 0x22, 0x23, 0x24, 0x25, 0x26, 0x27, 0x28, 0x29,
-            0x2A, 0x2B, 0x2C, 0x2D, 0x2E, 0x2F, 0x30, 0x31, 0x32, 0x33,
-            0x34, 0x35, 0x36, 0x37, 0x38, 0x39, 0x3A, 0x3B, 0x3C, 0x3D,
-            0x3E, 0x3F, 0x40, 0x41, 0x42, 0x43, 0x44, 0x45, 0x46, 0x47,
-            0x48, 0x49, 0x4A, 0x4B, 0x4C, 0x4D, 0x4E, 0x4F, 0x50, 0x51,
-            0x52, 0x53, 0x54, 0x55, 0x56, 0x57, 0x58, 0x59, 0x5A, 0x5B,
-            0x5C, 0x5D, 0x5E, 0x5F, 0x60, 0x61, 0x62, 0x63, 0x64, 0x65,
-            0x66, 0x67, 0x68, 0x69, 0x6A, 0x6B, 0x6C, 0x12
-        )
         # Must be proper length
         if len(cmd) != self.length_packet:
             out("Command length = " + str(len(cmd)) + "-- should be " + \
                 str(self.length_packet) + nl)
             return 0
+        cmd = bytearray(cmd)
         # First character must be 0xaa
-        if ord(cmd[0]) != 0xaa:
+        if cmd[0] != 0xaa:
             out("First byte should be 0xaa" + nl)
             return 0
         # Second character (address) must not be 0xff
-        if ord(cmd[1]) == 0xff:
+        if cmd[1] == 0xff:
             out("Second byte cannot be 0xff" + nl)
             return 0
         # Third character must be valid command
-        byte3 = "%02X" % ord(cmd[2])
-        if ord(cmd[2]) not in commands:
-            out("Third byte not a valid command:  %s\n" % byte3)
+        if cmd[2] not in self.valid_commands:
+            out("Third byte not a valid command:  %02X\n" % cmd[2])
             return 0
         # Calculate checksum and validate it
         checksum = self.CalculateChecksum(cmd)
-        if checksum != ord(cmd[-1]):
+        if checksum != cmd[-1]:
             out("Incorrect checksum" + nl)
             return 0
         return 1
@@ -139,13 +160,74 @@ class InstrumentInterface:
         '''Return the sum of the bytes in cmd modulo 256.
         '''
         assert((len(cmd) == self.length_packet - 1) or (len(cmd) == self.length_packet))
-        checksum = 0
-        for i in xrange(self.length_packet - 1):
-            checksum += ord(cmd[i])
-        checksum %= 256
-        return checksum
+        # Works on strings and bytearrays alike, without copying them.
+        return sum(memoryview(cmd)[:self.length_packet - 1].tolist()) & 0xff
     def StartCommand(self, byte):
         return chr(0xaa) + chr(self.address) + chr(byte)
+    def PackCommand(self, command, value_struct=None, *values):
+        '''Pack a command into the shared packet buffer and return the
+        buffer.  value_struct is a struct.Struct for the payload and values
+        the numbers to pack into it.  The buffer is overwritten by the next
+        command, use str() on it to keep a copy.
+        '''
+        packet = self.packet
+        self.header_struct.pack_into(packet, 0, 0xaa, self.address, command)
+        packet[self.payload_offset:-1] = self.empty_payload
+        if value_struct is not None:
+            value_struct.pack_into(packet, self.payload_offset, *values)
+        packet[-1] = self.CalculateChecksum(packet)
+        if self.validate:
+            assert(self.CommandProperlyFormed(packet))
+        return packet
+    def Transact(self, command, msg, value_struct=None, *values):
+        '''Pack a command, send it and return the response.
+        '''
+        cmd = self.PackCommand(command, value_struct, *values)
+        response = self.SendCommand(cmd)
+        self.PrintCommandAndResponse(cmd, response, msg)
+        return response
+    def PackCommands(self, commands):
+        '''Pack a sequence of (command, value_struct, values) into one
+        buffer of back to back packets.
+        '''
+        n = self.length_packet
+        packets = bytearray(len(commands)*n)
+        for i, (command, value_struct, values) in enumerate(commands):
+            packets[i*n:(i + 1)*n] = self.PackCommand(command, value_struct, *values)
+        return packets
+    def TransactBatch(self, commands, msg):
+        '''Send a sequence of (command, value_struct, values) with one write
+        per max_batch_packets commands, then read all the responses in one
+        go.  Saves a half-duplex turnaround per command.  Returns the list
+        of responses.
+        '''
+        n = self.length_packet
+        responses = []
+        for start in xrange(0, len(commands), self.max_batch_packets):
+            chunk = commands[start:start + self.max_batch_packets]
+            packets = self.PackCommands(chunk)
+            self.sp.write(packets)
+            data = self.sp.read(len(packets))
+            if len(data) != len(packets):
+                raise InstrumentException("%s: expected %d response bytes, got %d" %
+                                          (msg, len(packets), len(data)))
+            for i in xrange(len(chunk)):
+                response = data[i*n:(i + 1)*n]
+                if self.debug:
+                    self.PrintCommandAndResponse(packets[i*n:(i + 1)*n], response,
+                        "%s (%d of %d)" % (msg, start + i + 1, len(commands)))
+                responses.append(response)
+        return responses
+    def BatchStatus(self, responses, names):
+        '''Return the ResponseStatus of every response that failed, as
+        "name: status" joined by "; ".  The empty string means all were OK.
+        '''
+        errors = []
+        for name, response in zip(names, responses):
+            status = self.ResponseStatus(response)
+            if status:
+                errors.append("%s: %s" % (name, status))
+        return join(errors, "; ")
     def SendCommand(self, command):
         '''Sends the command to the serial stream and returns the 26 byte
         response.
@@ -159,42 +241,21 @@ class InstrumentInterface:
         '''Return a message string about what the response meant.  The
         empty string means the response was OK.
         '''
-        responses = {
-            0x90 : "Wrong checksum",
-            0xA0 : "Incorrect parameter value",
-            0xB0 : "Command cannot be carried out",
-            0xC0 : "Invalid command",
-            0x80 : "",
-        }
         assert(len(response) == self.length_packet)
         assert(ord(response[2]) == 0x12)
-        return responses[ord(response[3])]
+        return self.responses[ord(response[3])]
     def CodeInteger(self, value, num_bytes=4):
         '''Construct a little endian string for the indicated value.  Two
         and 4 byte integers are the only ones allowed.
         '''
         assert(num_bytes == 1 or num_bytes == 2 or num_bytes == 4)
-        value = int(value)  # Make sure it's an integer
-        s  = chr(value & 0xff)
-        if num_bytes >= 2:
-            s += chr((value & (0xff << 8)) >> 8)
-            if num_bytes == 4:
-                s += chr((value & (0xff << 16)) >> 16)
-                s += chr((value & (0xff << 24)) >> 24)
-                assert(len(s) == 4)
-        return s
+        return self.integer_structs[num_bytes].pack(int(value) & self.integer_masks[num_bytes])
     def DecodeInteger(self, str):
         '''Construct an integer from the little endian string. 1, 2, and 4 byte
         strings are the only ones allowed.
         '''
         assert(len(str) == 1 or len(str) == 2 or len(str) == 4)
-        n  = ord(str[0])
-        if len(str) >= 2:
-            n += (ord(str[1]) << 8)
-            if len(str) == 4:
-                n += (ord(str[2]) << 16)
-                n += (ord(str[3]) << 24)
-        return n
+        return self.integer_structs[len(str)].unpack(str)[0]
     def GetReserved(self, num_used):
         '''Construct a string of nul characters of such length to pad a
         command to one less than the packet size (leaves room for the
@@ -216,27 +277,19 @@ class InstrumentInterface:
         '''Construct the command with an integer value of 0, 1, 2, or
         4 bytes.
         '''
-        cmd = self.StartCommand(command)
         if num_bytes > 0:
-            r = num_bytes + 3
-            cmd += self.CodeInteger(value)[:num_bytes] + self.Reserved(r)
+            cmd = self.PackCommand(command, self.integer_structs[num_bytes],
+                                   int(value) & self.integer_masks[num_bytes])
         else:
-            cmd += self.Reserved(0)
-        cmd += chr(self.CalculateChecksum(cmd))
-        assert(self.CommandProperlyFormed(cmd))
-        return cmd
+            cmd = self.PackCommand(command)
+        return str(cmd)
     def GetData(self, data, num_bytes=4):
         '''Extract the little endian integer from the data and return it.
         '''
         assert(len(data) == self.length_packet)
-        if num_bytes == 1:
-            return ord(data[3])
-        elif num_bytes == 2:
-            return self.DecodeInteger(data[3:5])
-        elif num_bytes == 4:
-            return self.DecodeInteger(data[3:7])
-        else:
+        if num_bytes not in self.integer_structs:
             raise Exception("Bad number of bytes:  %d" % num_bytes)
+        return self.integer_structs[num_bytes].unpack_from(data, self.payload_offset)[0]
     def Reserved(self, num_used):
         assert(num_used >= 3 and num_used < self.length_packet - 1)
         return chr(0)*(self.length_packet - num_used - 1)
@@ -244,9 +297,8 @@ class InstrumentInterface:
         '''Send the indicated command along with value encoded as an integer
         of the specified size.  Return the instrument's response status.
         '''
-        cmd = self.GetCommand(byte, value, num_bytes)
-        response = self.SendCommand(cmd)
-        self.PrintCommandAndResponse(cmd, response, msg)
+        response = self.Transact(byte, msg, self.integer_structs[num_bytes],
+                                 int(value) & self.integer_masks[num_bytes])
         return self.ResponseStatus(response)
     def GetIntegerFromLoad(self, cmd_byte, msg, num_bytes=4):
         '''Construct a command from the byte in cmd_byte, send it, get
@@ -255,13 +307,55 @@ class InstrumentInterface:
         the printout.  Return the integer.
         '''
         assert(num_bytes == 1 or num_bytes == 2 or num_bytes == 4)
-        cmd = self.StartCommand(cmd_byte)
-        cmd += self.Reserved(3)
-        cmd += chr(self.CalculateChecksum(cmd))
-        assert(self.CommandProperlyFormed(cmd))
-        response = self.SendCommand(cmd)
-        self.PrintCommandAndResponse(cmd, response, msg)
-        return self.DecodeInteger(response[3:3 + num_bytes])
+        response = self.Transact(cmd_byte, msg)
+        return self.GetData(response, num_bytes)
+
+class InputSampleBuffer:
+    '''Ring buffer of input value samples filled by
+    DCLoad.SampleInputValues.  Each field is a preallocated array.array, so
+    numpy.frombuffer can wrap them without a copy.  Once capacity samples
+    are stored the oldest ones are overwritten; energy_wh and charge_ah
+    keep integrating over every sample ever appended.
+    '''
+    def __init__(self, capacity=100000):
+        self.capacity = capacity
+        self.timestamps   = array.array("d", [0.0])*capacity  # seconds, monotonic
+        self.voltages     = array.array("d", [0.0])*capacity  # V
+        self.currents     = array.array("d", [0.0])*capacity  # A
+        self.powers       = array.array("d", [0.0])*capacity  # W
+        self.op_states    = array.array("B", [0])*capacity
+        self.demand_states = array.array("H", [0])*capacity
+        self.Clear()
+    def Clear(self):
+        self.count = 0        # samples appended since the last Clear
+        self.energy_wh = 0.0  # trapezoidal integral of power
+        self.charge_ah = 0.0  # trapezoidal integral of current
+        self.last = None      # (timestamp, voltage, current, power, op_state, demand_state)
+    def __len__(self):
+        return min(self.count, self.capacity)
+    def Append(self, timestamp, voltage, current, power, op_state, demand_state):
+        if self.last is not None:
+            hours = (timestamp - self.last[0])/3600.0
+            self.energy_wh += (power + self.last[3])/2*hours
+            self.charge_ah += (current + self.last[2])/2*hours
+        i = self.count % self.capacity
+        self.timestamps[i] = timestamp
+        self.voltages[i] = voltage
+        self.currents[i] = current
+        self.powers[i] = power
+        self.op_states[i] = op_state
+        self.demand_states[i] = demand_state
+        self.count += 1
+        self.last = (timestamp, voltage, current, power, op_state, demand_state)
+    def Samples(self):
+        '''Return the stored samples oldest first as a list of
+        (timestamp, voltage, current, power, op_state, demand_state).
+        '''
+        n = len(self)
+        first = self.count - n
+        fields = (self.timestamps, self.voltages, self.currents, self.powers,
+                  self.op_states, self.demand_states)
+        return [tuple(f[(first + k) % self.capacity] for f in fields) for k in xrange(n)]
 
 class DCLoad(InstrumentInterface):
     _reg_clsid_      = "{943E2FA3-4ECE-448A-93AF-9ECAEB49CA1B}"
@@ -289,6 +383,8 @@ class DCLoad(InstrumentInterface):
         "GetTransient",
         "GetTriggerSource",
         "Initialize",
+        "ProgramRegisters",
+        "ReadInputValues",
         "RecallSettings",
         "SaveSettings",
         "SetBatteryTestVoltage",
@@ -298,6 +394,7 @@ class DCLoad(InstrumentInterface):
         "SetCWPower",
         "SetCommunicationAddress",
         "SetFunction",
+        "SetList",
         "SetLoadOnTimer",
         "SetLoadOnTimerState",
         "SetLocalControl",
@@ -314,6 +411,14 @@ class DCLoad(InstrumentInterface):
         "TurnLoadOff",
         "TurnLoadOn",
     ]
+    # Payload layouts of the transient (0x32-0x39) and input values (0x5F)
+    # packets.
+    transient_struct = struct.Struct("<IHIHB")
+    input_values_struct = struct.Struct("<IIIBH")
+    # List mode:  step number, level, step time.
+    list_step_struct = struct.Struct("<HIH")
+    list_step_time_unit = 1e4  # Converts seconds to the step time's 0.1 ms
+    max_list_steps = 84
     def Initialize(self, com_port, baudrate, address=0):
         "Initialize the base class"
         InstrumentInterface.Initialize(self, com_port, baudrate, address)
@@ -423,35 +528,21 @@ class DCLoad(InstrumentInterface):
             const = self.convert_power
         else:
             const = self.convert_resistance
-        cmd = self.StartCommand(opcodes[mode.lower()])
-        cmd += self.CodeInteger(A*const, num_bytes=4)
-        cmd += self.CodeInteger(A_time_s*self.to_ms, num_bytes=2)
-        cmd += self.CodeInteger(B*const, num_bytes=4)
-        cmd += self.CodeInteger(B_time_s*self.to_ms, num_bytes=2)
         transient_operations = {"continuous":0, "pulse":1, "toggled":2}
-        cmd += self.CodeInteger(transient_operations[operation], num_bytes=1)
-        cmd += self.Reserved(16)
-        cmd += chr(self.CalculateChecksum(cmd))
-        assert(self.CommandProperlyFormed(cmd))
-        response = self.SendCommand(cmd)
-        self.PrintCommandAndResponse(cmd, response, "Set %s transient" % mode)
+        response = self.Transact(opcodes[mode.lower()], "Set %s transient" % mode,
+                                 self.transient_struct,
+                                 int(A*const) & 0xffffffff, int(A_time_s*self.to_ms) & 0xffff,
+                                 int(B*const) & 0xffffffff, int(B_time_s*self.to_ms) & 0xffff,
+                                 transient_operations[operation])
         return self.ResponseStatus(response)
     def GetTransient(self, mode):
         "Gets the transient mode settings"
         if mode.lower() not in self.modes:
             raise Exception("Unknown mode")
         opcodes = {"cc":0x33, "cv":0x35, "cw":0x37, "cr":0x39}
-        cmd = self.StartCommand(opcodes[mode.lower()])
-        cmd += self.Reserved(3)
-        cmd += chr(self.CalculateChecksum(cmd))
-        assert(self.CommandProperlyFormed(cmd))
-        response = self.SendCommand(cmd)
-        self.PrintCommandAndResponse(cmd, response, "Get %s transient" % mode)
-        A = self.DecodeInteger(response[3:7])
-        A_timer_ms = self.DecodeInteger(response[7:9])
-        B = self.DecodeInteger(response[9:13])
-        B_timer_ms = self.DecodeInteger(response[13:15])
-        operation = self.DecodeInteger(response[15])
+        response = self.Transact(opcodes[mode.lower()], "Get %s transient" % mode)
+        A, A_timer_ms, B, B_timer_ms, operation = \
+            self.transient_struct.unpack_from(response, self.payload_offset)
         time_const = 1e3
         transient_operations_inv = {0:"continuous", 1:"pulse", 2:"toggled"}
         if mode.lower() == "cc":
@@ -544,12 +635,7 @@ class DCLoad(InstrumentInterface):
         '''Provide a software trigger.  This is only of use when the trigger
         mode is set to "bus".
         '''
-        cmd = self.StartCommand(0x5A)
-        cmd += self.Reserved(3)
-        cmd += chr(self.CalculateChecksum(cmd))
-        assert(self.CommandProperlyFormed(cmd))
-        response = self.SendCommand(cmd)
-        self.PrintCommandAndResponse(cmd, response, "Trigger load (trigger = bus)")
+        response = self.Transact(0x5A, "Trigger load (trigger = bus)")
         return self.ResponseStatus(response)
     def SaveSettings(self, register=0):
         "Save instrument settings to a register"
@@ -559,10 +645,64 @@ class DCLoad(InstrumentInterface):
     def RecallSettings(self, register=0):
         "Restore instrument settings from a register"
         assert(self.lowest_register <= register <= self.highest_register)
-        cmd = self.GetCommand(0x5C, register, num_bytes=1)
-        response = self.SendCommand(cmd)
-        self.PrintCommandAndResponse(cmd, response, "Recall register %d" % register)
+        response = self.Transact(0x5C, "Recall register %d" % register,
+                                 self.integer_structs[1], register)
         return self.ResponseStatus(response)
+    def LevelCommand(self, mode):
+        '''Return (set command, conversion factor) of a mode's level.
+        '''
+        if mode.lower() not in self.modes:
+            raise Exception("Unknown mode")
+        return {"cc":(0x2A, self.convert_current),
+                "cv":(0x2C, self.convert_voltage),
+                "cw":(0x2E, self.convert_power),
+                "cr":(0x30, self.convert_resistance)}[mode.lower()]
+    def SetList(self, mode, steps, repeat=0):
+        '''Program list mode in one batch.  mode is one of "CC", "CV", "CW"
+        or "CR" (a list runs in a single mode) and steps a sequence of
+        (level, dwell_s) in SI units.  repeat=1 runs the list repeatedly
+        instead of once.  Use SetFunction to start list operation.
+        Returns the failed steps' status, the empty string when all were
+        accepted.
+        '''
+        if mode.lower() not in self.modes:
+            raise Exception("Unknown mode")
+        if not 2 <= len(steps) <= self.max_list_steps:
+            raise Exception("A list has 2 to %d steps, not %d" % (self.max_list_steps, len(steps)))
+        opcodes = {"cc":0x40, "cv":0x42, "cw":0x44, "cr":0x46}
+        const = self.LevelCommand(mode)[1]
+        byte = self.integer_structs[1]
+        commands = [(0x3A, byte, (self.modes[mode.lower()],)),
+                    (0x3C, byte, (int(bool(repeat)),)),
+                    (0x3E, self.integer_structs[2], (len(steps),))]
+        names = ["Set list mode", "Set list repeat", "Set list step count"]
+        for i, (level, dwell_s) in enumerate(steps):
+            dwell = int(dwell_s*self.list_step_time_unit)
+            if not 0 <= dwell <= 0xffff:
+                raise Exception("Step %d dwell time %r s out of range" % (i + 1, dwell_s))
+            commands.append((opcodes[mode.lower()], self.list_step_struct,
+                             (i + 1, int(level*const) & 0xffffffff, dwell)))
+            names.append("List step %d" % (i + 1))
+        return self.BatchStatus(self.TransactBatch(commands, "Set list"), names)
+    def ProgramRegisters(self, settings, first_register=1):
+        '''Store a sequence of (mode, level) settings, in SI units, in
+        consecutive registers starting at first_register, all in one batch.
+        Returns the failed commands' status, the empty string when all were
+        accepted.
+        '''
+        last_register = first_register + len(settings) - 1
+        assert(self.lowest_register <= first_register and last_register <= self.highest_register)
+        commands = []
+        names = []
+        for register, (mode, level) in enumerate(settings, first_register):
+            command, const = self.LevelCommand(mode)
+            commands += [(0x28, self.integer_structs[1], (self.modes[mode.lower()],)),
+                         (command, self.integer_structs[4], (int(level*const) & 0xffffffff,)),
+                         (0x5B, self.integer_structs[1], (register,))]
+            names += ["Set mode (register %d)" % register,
+                      "Set level (register %d)" % register,
+                      "Save to register %d" % register]
+        return self.BatchStatus(self.TransactBatch(commands, "Program registers"), names)
     def SetFunction(self, function="fixed"):
         '''Set the function (type of operation) of the load.
         function is one of "fixed", "short", "transient", or "battery".
@@ -581,28 +721,69 @@ class DCLoad(InstrumentInterface):
         '''Returns voltage in V, current in A, and power in W, op_state byte,
         and demand_state byte.
         '''
-        cmd = self.StartCommand(0x5F)
-        cmd += self.Reserved(3)
-        cmd += chr(self.CalculateChecksum(cmd))
-        assert(self.CommandProperlyFormed(cmd))
-        response = self.SendCommand(cmd)
-        self.PrintCommandAndResponse(cmd, response, "Get input values")
-        voltage = self.DecodeInteger(response[3:7])/self.convert_voltage
-        current = self.DecodeInteger(response[7:11])/self.convert_current
-        power   = self.DecodeInteger(response[11:15])/self.convert_power
-        op_state = hex(self.DecodeInteger(response[15]))
-        demand_state = hex(self.DecodeInteger(response[16:18]))
+        voltage, current, power, op_state, demand_state = self.ReadInputValues()
+        op_state = hex(op_state)
+        demand_state = hex(demand_state)
         s = [str(voltage) + " V", str(current) + " A", str(power) + " W", str(op_state), str(demand_state)]
         return join(s, "\t")
+    def ReadInputValues(self):
+        '''Returns (voltage in V, current in A, power in W, op_state,
+        demand_state) as numbers, for callers that don't want to parse
+        GetInputValues' string.
+        '''
+        response = self.Transact(0x5F, "Get input values")
+        return self.DecodeInputValues(response)
+    def DecodeInputValues(self, response):
+        voltage, current, power, op_state, demand_state = \
+            self.input_values_struct.unpack_from(response, self.payload_offset)
+        return (voltage/self.convert_voltage, current/self.convert_current,
+                power/self.convert_power, op_state, demand_state)
+    def SampleInputValues(self, count=None, duration=None, samples=None, stop_when=None):
+        '''Poll the input values back to back, as fast as the serial link
+        allows, into an InputSampleBuffer (a new one unless samples is
+        given), and return it.  Stops after count samples, after duration
+        seconds or when stop_when(voltage, current, power) returns true,
+        whichever comes first; at least one of them is required.  Example,
+        discharge a battery down to 3 V:
+            samples = load.SampleInputValues(stop_when=lambda v, i, p: v < 3.0)
+            print samples.charge_ah
+        '''
+        if count is None and duration is None and stop_when is None:
+            raise InstrumentException("SampleInputValues needs count, duration or stop_when")
+        if samples is None:
+            samples = InputSampleBuffer(count if count is not None else 100000)
+        # The request never changes: pack it once, then only read and decode.
+        cmd = str(self.PackCommand(0x5F))
+        write, read = self.sp.write, self.sp.read
+        unpack_from, offset = self.input_values_struct.unpack_from, self.payload_offset
+        convert_voltage, convert_current, convert_power = \
+            self.convert_voltage, self.convert_current, self.convert_power
+        length_packet, append = self.length_packet, samples.Append
+        end_time = None if duration is None else monotonic() + duration
+        n = 0
+        while count is None or n < count:
+            write(cmd)
+            response = read(length_packet)
+            timestamp = monotonic()
+            if len(response) != length_packet:
+                raise InstrumentException("Short input values response: %d bytes" % len(response))
+            if self.debug:
+                self.PrintCommandAndResponse(cmd, response, "Get input values")
+            voltage, current, power, op_state, demand_state = unpack_from(response, offset)
+            voltage /= convert_voltage
+            current /= convert_current
+            power   /= convert_power
+            append(timestamp, voltage, current, power, op_state, demand_state)
+            n += 1
+            if end_time is not None and timestamp >= end_time:
+                break
+            if stop_when is not None and stop_when(voltage, current, power):
+                break
+        return samples
     # Returns model number, serial number, and firmware version number
     def GetProductInformation(self):
         "Returns model number, serial number, and firmware version"
-        cmd = self.StartCommand(0x6A)
-        cmd += self.Reserved(3)
-        cmd += chr(self.CalculateChecksum(cmd))
-        assert(self.CommandProperlyFormed(cmd))
-        response = self.SendCommand(cmd)
-        self.PrintCommandAndResponse(cmd, response, "Get product info")
+        response = self.Transact(0x6A, "Get product info")
         model = response[3:8]
         fw = hex(ord(response[9]))[2:] + "."
         fw += hex(ord(response[8]))[2:]
@@ -1,3 +1,7 @@
+import array
+import Queue
+import threading
+import time
 import visa_instrument
 
 # pylint: disable=R0904
@@ -5,6 +9,14 @@ import visa_instrument
 
 ERROR_BIT = 0b10000000
 
+# Volatile reading memory of the 34460/34461.  stream() has to drain it before it fills up.
+READING_MEMORY_SIZE = 10000
+# Bounds for stream()'s adaptive DATA:POIN? poll interval, in seconds.
+STREAM_MIN_POLL_INTERVAL = 0.01
+STREAM_MAX_POLL_INTERVAL = 2.0
+# Chunks stream() may buffer for a slow consumer before the poller waits for it.
+STREAM_MAX_QUEUED_CHUNKS = 16
+
 
 class DMMError(Exception):
     pass
@@ -35,6 +47,17 @@ class Agilent34461DMM(visa_instrument.VisaInstrument):
     VOLTAGE_AC = "VOLTage:AC"
     VOLTAGE_DC = "VOLTage:DC"
 
+    # Data formats for bulk transfers (FORM:DATA)
+    DATA_FORMAT_ASCII = "ASC"
+    DATA_FORMAT_REAL_32 = "REAL,32"
+    DATA_FORMAT_REAL_64 = "REAL,64"
+
+    # Settings that don't need to be re-sent if they haven't changed (see VisaInstrument shadow state cache).
+    _STATE_CACHE_HEADERS = ("FUNC", "VOLT:RANG", "CURR:RANG", "TRIG:DEL", "SAMP:COUN", "SAMP:SOUR", "SAMP:TIM",
+                            "FORM:DATA", "FORM:BORD")
+    # MEAS?/CONF reconfigure function, range and trigger settings.
+    _STATE_RESET_PREFIXES = visa_instrument.VisaInstrument._STATE_RESET_PREFIXES + ("MEAS", "CONF")
+
     def __init__(self, resourceName, do_selftest=True):
         visa_instrument.VisaInstrument.__init__(self, resourceName, do_selftest=do_selftest)
         self._no_error_string = "+0,\"No error\"\n"
@@ -62,16 +85,123 @@ class Agilent34461DMM(visa_instrument.VisaInstrument):
         self.send_command_and_check_error("FUNC \"" + measurement_function + "\"")  # Set the measurement function
 
     def start_logging(self, trigger_delay, sample_count, sample_interval):
-        self.send_command_and_check_error("DATA:DEL NVMEM")                     # Clear data from non-volatile memory
-        self.send_command_and_check_error("TRIG:DEL " + str(trigger_delay))     # Set trigger delay
-        self.send_command_and_check_error("SAMP:COUN " + str(sample_count))     # Set the number sameples
-        self.send_command_and_check_error("SAMP:SOUR TIM")                      # Set source of sample trigger as timer
-        self.send_command_and_check_error("SAMP:TIM " + str(sample_interval))   # Set timer trigger interval
-        self.send_command_and_check_error("INIT")                               # Start measurement
-
-    def fetch_data_points_and_clear(self):
+        with self.batch():
+            self.send_command_and_check_error("DATA:DEL NVMEM")                     # Clear data from non-volatile memory
+            self.send_command_and_check_error("TRIG:DEL " + str(trigger_delay))     # Set trigger delay
+            self.send_command_and_check_error("SAMP:COUN " + str(sample_count))     # Set the number sameples
+            self.send_command_and_check_error("SAMP:SOUR TIM")                      # Set source of sample trigger as timer
+            self.send_command_and_check_error("SAMP:TIM " + str(sample_interval))   # Set timer trigger interval
+        self.send_command_and_check_error("INIT")                                   # Start measurement
+
+    def fetch_data_points_and_clear(self, data_format=DATA_FORMAT_ASCII):
+        # data_format REAL,32/REAL,64 returns an array.array instead of a list: half the bytes on the wire
+        # and no per-reading float parsing, which matters for big logging buffers.
         data_point_count = self.ask_for_value("DATA:POIN?")               # Get the number of data points avaiable
-        return self.ask_for_values("DATA:REM? " + str(data_point_count))  # Fetch all data points and remove
+        if data_format == self.DATA_FORMAT_ASCII:
+            return self.ask_for_values("DATA:REM? " + str(data_point_count))  # Fetch all data points and remove
+        if data_format not in (self.DATA_FORMAT_REAL_32, self.DATA_FORMAT_REAL_64):
+            raise DMMError("Unsupported data format [{0}]".format(data_format))
+
+        # FORM:DATA also applies to MEAS?/READ? replies, so only leave it in binary for this transfer.
+        with self.batch():
+            self.send_command_and_check_error("FORM:BORD NORM")
+            self.send_command_and_check_error("FORM:DATA " + data_format)
+        try:
+            return self.ask_for_binary_values("DATA:REM? " + str(int(data_point_count)),
+                                              is_single=(data_format == self.DATA_FORMAT_REAL_32))
+        finally:
+            self.send_command_and_check_error("FORM:DATA " + self.DATA_FORMAT_ASCII)
+
+    def stream(self, sample_interval, chunk=1000, sample_count=1000000, trigger_delay=0):
+        '''Start logging and yield (timestamps, readings) as chunks of chunk readings come in.
+
+        Both are array.array('d') of the same length; timestamps are time.time() based, computed from the
+        sample interval.  The last chunk may be shorter.  A background thread keeps draining the DMM's reading
+        memory with DATA:REM? (binary REAL,64), polling DATA:POIN? at an interval that adapts to the observed fill
+        rate: often enough to never get close to overflowing READING_MEMORY_SIZE, rarely enough to not spam
+        the bus.  Leaving the loop early aborts the measurement.
+
+        Don't use the DMM from another thread while streaming.
+
+            for timestamps, readings in dmm.stream(0.001, chunk=5000, sample_count=3600000):
+                log_file.write(...)
+        '''
+        if chunk < 1 or chunk > READING_MEMORY_SIZE / 2:
+            raise DMMError("chunk must be between 1 and {0}".format(READING_MEMORY_SIZE / 2))
+
+        output_queue = Queue.Queue(STREAM_MAX_QUEUED_CHUNKS)
+        stop_event = threading.Event()
+
+        self.send_command_and_check_error("FORM:BORD NORM")
+        self.send_command_and_check_error("FORM:DATA " + self.DATA_FORMAT_REAL_64)
+        self.start_logging(trigger_delay, sample_count, sample_interval)
+        start_time = time.time() + trigger_delay
+
+        poller = threading.Thread(target=self._stream_poller,
+                                  args=(output_queue, stop_event, start_time, sample_interval, chunk, sample_count),
+                                  name="Agilent34461DMMStream")
+        poller.daemon = True
+        poller.start()
+        try:
+            while True:
+                item = output_queue.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop_event.set()
+            poller.join()
+
+    def _stream_poller(self, output_queue, stop_event, start_time, sample_interval, chunk, sample_count):
+        pending = array.array('d')
+        fetched = 0
+        next_index = 0
+        fill_rate = 1.0 / sample_interval  # readings/s, corrected from what we actually see
+        last_poll_time = time.time()
+
+        def put(item):
+            # Don't block forever on a consumer that went away.
+            while not stop_event.is_set():
+                try:
+                    output_queue.put(item, timeout=0.1)
+                    return
+                except Queue.Full:
+                    pass
+
+        try:
+            while fetched < sample_count and not stop_event.is_set():
+                available = int(self.ask_for_value("DATA:POIN?"))
+                now = time.time()
+                if available:
+                    readings = self.ask_for_binary_values("DATA:REM? " + str(available))
+                    fetched += len(readings)
+                    pending.extend(readings)
+                    # smooth it a bit; first polls include the trigger delay.
+                    fill_rate = 0.5 * fill_rate + 0.5 * (available / max(now - last_poll_time, 1e-6))
+                while len(pending) >= chunk or (pending and fetched >= sample_count):
+                    readings = pending[:chunk]
+                    del pending[:chunk]
+                    timestamps = array.array('d', [start_time + (next_index + i) * sample_interval
+                                                   for i in range(len(readings))])
+                    next_index += len(readings)
+                    put((timestamps, readings))
+                last_poll_time = now
+
+                # Come back when about one chunk is waiting, but well before the reading memory fills up.
+                poll_interval = min(float(chunk) / fill_rate, READING_MEMORY_SIZE / 4.0 / fill_rate)
+                stop_event.wait(max(STREAM_MIN_POLL_INTERVAL, min(poll_interval, STREAM_MAX_POLL_INTERVAL)))
+        except Exception as error:  # pylint: disable=W0703
+            put(error)
+        finally:
+            try:
+                if fetched < sample_count:
+                    self.abort()
+                self.send_command_and_check_error("FORM:DATA " + self.DATA_FORMAT_ASCII)
+            except Exception as error:  # pylint: disable=W0703
+                put(error)
+            put(None)
 
     def abort(self):
         self.send_command_and_check_error("ABOR")                               # Abort previous operation
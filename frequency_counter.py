@@ -10,6 +10,8 @@ import os
 import subprocess
 import json
 
+import ni_helper
+
 ENABLE_DEVICE = True
 
 
@@ -29,10 +31,13 @@ class NIFrequencyCounterTimeoutException(Exception):
 
 
 class NIFrequencyCounter(object):
-    def __init__(self, ni_device_id=1, binary_path="niFreqCtr.exe"):
+    def __init__(self, ni_device_id=1, binary_path="niFreqCtr.exe", persistent=False, helper_command=None):
         self._dev = "Dev%d" % ni_device_id
         self._binary_path = binary_path
         self._is_debug_enabled = False
+        # persistent: keep one niFreqCtr --serve process running instead of starting the exe per measurement
+        self._persistent = persistent
+        self._helper_command = helper_command
 
     def enable_debug(self, enable=True):
         self._is_debug_enabled = enable
@@ -47,6 +52,14 @@ class NIFrequencyCounter(object):
         self._binary_path = path
 
     def measure_frequency(self):
+        if self._persistent and ENABLE_DEVICE:
+            try:
+                return self._helper().request("measure_frequency").get("FREQ_HZ")
+            except ni_helper.NIHelperException as the_exception:
+                if the_exception.code == -200474:
+                    raise NIFrequencyCounterTimeoutException()
+                raise NIFrequencyCounterException("Helper error: [%s]" % the_exception)
+
         call_string = self._binary_path
         (output, exit_code) = self._dispatch(call_string)
         if not exit_code == 0:
@@ -61,6 +74,10 @@ class NIFrequencyCounter(object):
             raise NIFrequencyCounterException("Unexpected console output received from util: [%s]" % output)
         return frequency
 
+    def _helper(self):
+        command = self._helper_command or [self._binary_path, ni_helper.HELPER_ARGUMENT, "-d", self._dev]
+        return ni_helper.get_helper(command)
+
     def _dispatch(self, call_string):
 
         self._debug_print(call_string)
@@ -0,0 +1,145 @@
+import Queue
+import sys
+import threading
+
+# Run operations on several instruments at the same time.
+#
+# VISA sessions are independent of each other, so there's no reason to wait for the power supply to settle
+# before telling the mux to close its relays.  The executor owns one worker thread per VISA session: calls
+# submitted for the same session still run in order, calls for different sessions overlap.  Drivers that share
+# a pooled session (see visa_instrument.VisaSessionPool) share its worker, so their I/O never interleaves.
+#
+#   with InstrumentExecutor() as executor:
+#       executor.submit(power_supply, power_supply.configure_and_enable_output, 5, 0.5)
+#       executor.submit(mux, mux.configure_measurement, 'voltage', '214', '10', 'DC')
+#       executor.submit(dmm, dmm.set_measurement_func, dmm.VOLTAGE_DC)
+#       executor.wait_all()
+#       voltage = executor.submit(dmm, dmm.measure_voltage).result()
+#
+# Only talk to an instrument through its executor while the executor is running it.
+# Calling the same driver from the main thread at the same time is not thread safe.
+
+
+class InstrumentExecutorError(Exception):
+    pass
+
+
+class InstrumentFuture(object):
+    # Result of one submitted call.  result() blocks until the call finished and
+    # re-raises whatever the call raised.
+
+    def __init__(self, description):
+        self.description = description
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise InstrumentExecutorError("Timed out waiting for " + self.description)
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise InstrumentExecutorError("Timed out waiting for " + self.description)
+        if self._exc_info is not None:
+            return self._exc_info[1]
+        return None
+
+    def _run(self, function, args, kwargs):
+        try:
+            self._result = function(*args, **kwargs)
+        except Exception:  # pylint: disable=W0703
+            # Hand it to whoever calls result().
+            self._exc_info = sys.exc_info()
+        self._done.set()
+
+
+class _InstrumentWorker(threading.Thread):
+
+    def __init__(self, instrument):
+        threading.Thread.__init__(self, name="InstrumentWorker-{0}".format(instrument.__class__.__name__))
+        self.daemon = True
+        self._queue = Queue.Queue()
+
+    def put(self, work_item):
+        self._queue.put(work_item)
+
+    def stop(self):
+        self._queue.put(None)
+
+    def run(self):
+        while True:
+            work_item = self._queue.get()
+            if work_item is None:
+                return
+            future, function, args, kwargs = work_item
+            future._run(function, args, kwargs)  # pylint: disable=W0212
+
+
+def _session_of(instrument):
+    # The VISA session a visa_instrument driver talks through; anything else is its own session.
+    return getattr(instrument, '_instrument', instrument)
+
+
+class InstrumentExecutor(object):
+
+    def __init__(self):
+        self._workers = {}      # id(session) -> worker thread
+        self._sessions = {}     # id(session) -> session, keeps the id valid while we run
+        self._futures = []
+        self._lock = threading.Lock()
+        self._shut_down = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+    def submit(self, instrument, function, *args, **kwargs):
+        '''Queue function(*args, **kwargs) on instrument's worker thread and return an InstrumentFuture.
+        '''
+        description = "{0}.{1}".format(instrument.__class__.__name__, getattr(function, '__name__', 'call'))
+        future = InstrumentFuture(description)
+        session = _session_of(instrument)
+        with self._lock:
+            if self._shut_down:
+                raise InstrumentExecutorError("Executor has been shut down")
+            worker = self._workers.get(id(session))
+            if worker is None:
+                worker = _InstrumentWorker(instrument)
+                self._workers[id(session)] = worker
+                self._sessions[id(session)] = session
+                worker.start()
+            self._futures.append(future)
+        worker.put((future, function, args, kwargs))
+        return future
+
+    def wait_all(self, timeout=None):
+        '''Wait for everything submitted since the last wait_all.  Returns the results in submission order,
+        raises the first exception any of those calls raised (after all of them are done).
+        '''
+        with self._lock:
+            futures = self._futures
+            self._futures = []
+        for future in futures:
+            future.exception(timeout)
+        return [future.result() for future in futures]
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            self._shut_down = True
+            workers = self._workers.values()
+            self._workers = {}
+            self._sessions = {}
+        for worker in workers:
+            worker.stop()
+        if wait:
+            for worker in workers:
+                worker.join()
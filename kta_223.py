@@ -1,6 +1,9 @@
 from .serial import Serial
 from time import sleep
 import collections
+import contextlib
+import re
+import time
 
 # todo:
 # convert the returned list from strings to numbers
@@ -13,6 +16,19 @@ KTA_RELAY_STATE_OFF = 'connect_normal_closed'
 KTA_RELAY_STATE_ON = 'connect_normal_open'
 VOLTS_PER_COUNT = 0.0048875
 
+# Most commands send_commands() puts on the bus before it waits for a reply.  On a 2-wire (half duplex) RS-485
+# bus a reply could collide with our next command, so by default every command waits for its reply.  On a
+# 4-wire (full duplex) bus pass pipeline_depth=FULL_DUPLEX_PIPELINE_DEPTH to KTA223 to keep several in flight.
+BUS_PIPELINE_DEPTH = 1
+FULL_DUPLEX_PIPELINE_DEPTH = 8
+
+RELAYS_PER_BOARD = 8
+
+# The driver remembers each board's relay byte so it doesn't have to read RS before every write.  Entries older
+# than this (seconds) are re-read, in case something else (front panel, another process) switched relays.
+RELAY_SHADOW_MAX_AGE = 30.0
+_RESPONSE_ADDRESS_RE = re.compile(r'^\s*#\s*(\d+)')
+
 
 class KTA223Error(Exception):
     pass
@@ -40,7 +56,7 @@ def _state_to_numeric(state):
 
 
 class KTA223(object):
-    def __init__(self, port, relay_addresses=None):
+    def __init__(self, port, relay_addresses=None, pipeline_depth=BUS_PIPELINE_DEPTH):
         serial_session = None
         if port == "FAKE":
             serial_session = FakeSerial()
@@ -52,6 +68,9 @@ class KTA223(object):
         self._addr = 00  # need to add a setter if we ever want to plug in more than one board to a PC (via USB)
         self._return_raw_string = False    # do we leave the #00 on the lead of every return string?
         self._relay_addresses = relay_addresses  # used for RS-485 addressing over one serial port
+        self._pipeline_depth = pipeline_depth   # see BUS_PIPELINE_DEPTH
+        self._relay_shadow = {}     # board address -> [relay byte, time it was last read back]
+        self._pending_relay_changes = None  # board address -> {relay: state} while in a transaction()
         # After a certain point, KTAs started
         sleep(1)
         self._serial_session.flushInput()
@@ -83,19 +102,67 @@ class KTA223(object):
     def readline(self):
         return self._serial_session.readline()
 
-    def send_command(self, command, parameter, address=None):
+    def _board_address(self, address):
         if self._relay_addresses is None:
-            data = b'@ %02d %s %d\r' % (self._addr, command, parameter)
-        else:
-            if address is not None and address in self._relay_addresses:
-                data = b'@ %02d %s %d\r' % (address, command, parameter)
-            else:
-                raise KTA223Error("Sending command to invalid address {0}".format(address))
+            return self._addr
+        if address is not None and address in self._relay_addresses:
+            return address
+        raise KTA223Error("Sending command to invalid address {0}".format(address))
+
+    def send_command(self, command, parameter, address=None):
+        data = b'@ %02d %s %d\r' % (self._board_address(address), command, parameter)
 
         self.debug_print("\nSending command [%s" % data)
         self.send(data)
         return self.readline()
 
+    def send_commands(self, commands, pipeline_depth=None):
+        """
+        Send several commands, to one or more boards on the bus, without waiting for each reply before sending
+        the next one.  Replies are matched to commands by their #NN address prefix.
+        :param commands: list of (command, parameter, address) tuples; parameter is a number or a preformatted
+         string such as '1 025' for TR.
+        :param pipeline_depth: most commands outstanding at once, default is the one given to the constructor
+        :return: list of raw replies, in the order of commands
+        """
+        if pipeline_depth is None:
+            pipeline_depth = self._pipeline_depth
+        addressed = []
+        for command, parameter, address in commands:
+            if not isinstance(parameter, basestring):
+                parameter = '%d' % parameter
+            board_address = self._board_address(address)
+            addressed.append((board_address, b'@ %02d %s %s\r' % (board_address, command, parameter)))
+
+        replies = [None] * len(addressed)
+        outstanding = collections.OrderedDict()    # index -> board address, oldest first
+        next_index = 0
+        self.flush_input()
+        while next_index < len(addressed) or outstanding:
+            # Fill the pipeline with one write.
+            burst = []
+            while next_index < len(addressed) and len(outstanding) < pipeline_depth:
+                board_address, data = addressed[next_index]
+                outstanding[next_index] = board_address
+                burst.append(data)
+                next_index += 1
+            if burst:
+                data = b''.join(burst)
+                self.debug_print("\nSending commands [%s" % data)
+                self._serial_session.write(data)
+
+            reply = self.readline()
+            match = _RESPONSE_ADDRESS_RE.match(reply)
+            for index, board_address in outstanding.items():
+                # Without a readable prefix (e.g. FAKE mode) the reply belongs to the oldest command.
+                if match is None or int(match.group(1)) == board_address:
+                    replies[index] = reply
+                    del outstanding[index]
+                    break
+            else:
+                raise KTA223Error("Unexpected reply on the bus: {0!r}".format(reply))
+        return replies
+
     ########################################################
     # High-level commands                                  #
     # These will return the value expected (i.e. 0 or 1 for a digital input channel) #
@@ -104,12 +171,33 @@ class KTA223(object):
     def set_relay_state(self, relay_id, state=KTA_RELAY_STATE_OFF, address=None):
         """
         relayID parameter is channel (1-8) or 'all'
+        Nothing is sent when the relay is known to be in that state already.
         """
+        board_address = self._board_address(address)
+        relay_id = 0 if relay_id == 'all' else int(relay_id)
+        channels = range(1, RELAYS_PER_BOARD + 1) if relay_id == 0 else [relay_id]
+        if self._pending_relay_changes is not None:
+            self._pending_relay_changes[board_address].update((channel, state) for channel in channels)
+            return ""
+
+        shadow = self._shadow_byte(board_address)
+        if shadow is not None:
+            new_byte = _apply_relay_states(shadow, dict((channel, state) for channel in channels))
+            if new_byte == shadow:
+                return ""
+
         kta_state_string = 'OF'
 
         if state == KTA_RELAY_STATE_ON:
             kta_state_string = 'ON'
-        return _cook_output_string(self.send_command(kta_state_string, int(relay_id), address))
+        try:
+            reply = self.send_command(kta_state_string, relay_id, address)
+        except Exception:
+            self.invalidate_relay_shadow(address)
+            raise
+        if shadow is not None:
+            self._relay_shadow[board_address][0] = new_byte
+        return _cook_output_string(reply)
 
     def turn_relay_on(self, relay_id, address=None):
         return self.set_relay_state(relay_id, state=KTA_RELAY_STATE_ON, address=address)
@@ -131,11 +219,26 @@ class KTA223(object):
         # I don't think this was intentional, so adding it now.  If you have problems
         # with this function, that may be it.
         #return _cook_output_string(self.send_command('WR', byte, address))
-        return self.send_command('WR', byte, address)
+        board_address = self._board_address(address)
+        if self._pending_relay_changes is not None:
+            self._pending_relay_changes[board_address].update(_relay_states_from_byte(byte))
+            return ""
+        if self._shadow_byte(board_address) == byte:
+            return ""
+        try:
+            reply = self.send_command('WR', byte, address)
+        except Exception:
+            self.invalidate_relay_shadow(address)
+            raise
+        self._set_shadow(board_address, byte)
+        return reply
 
     def get_relay_status_byte(self, address=None):
         """returns an integer number between 0 and 255"""
-        return _cook_output_string(self.send_command('RS', 0, address))
+        value = _cook_output_string(self.send_command('RS', 0, address))
+        if isinstance(value, str) and value.isdigit():
+            self._set_shadow(self._board_address(address), int(value))
+        return value
 
     def get_relay_status(self, relay_id, address=None):
         return _cook_output_string(self.send_command('RS', int(relay_id), address))
@@ -192,14 +295,16 @@ class KTA223(object):
     # NOTES:
     #   channels are 1-based (not 0-based)
     #   if a channel is not in the dict, it is left at its initial state.
+    #   returns the reply to the WR command, "" if no relay had to change (or inside a transaction()).
     def set_multiple_relay_values(self, channel_state_dict, address=None):
-        byte_val = int(self.get_relay_status_byte())
-
-        for channel_num in channel_state_dict:
-            if channel_state_dict[channel_num] is KTA_RELAY_STATE_ON:
-                byte_val |= (1 << (channel_num - 1))
-            elif channel_state_dict[channel_num] is KTA_RELAY_STATE_OFF:
-                byte_val &= (~(1 << (channel_num - 1)))
+        board_address = self._board_address(address)
+        if self._pending_relay_changes is not None:
+            self._pending_relay_changes[board_address].update(channel_state_dict)
+            return ""
+        byte_val = self._shadow_byte(board_address)
+        if byte_val is None and len(channel_state_dict) < RELAYS_PER_BOARD:
+            byte_val = self.resync_relay_shadow([address])[board_address]
+        byte_val = _apply_relay_states(byte_val or 0, channel_state_dict)
 
         #set the relays
         print "Setting relays to %s" % byte_val
@@ -214,17 +319,9 @@ class KTA223(object):
         :param address:
         :return:
         """
-        if time_seconds > 25.5:
-            raise KTA223Error("Cannot set timed relay for longer than 25.5s")
-        time_tenths_seconds_string = time_seconds * 10
-        # practically duplicating send_command here because of the %03d needed below
-        if self._relay_addresses is None:
-            data = b'@ %02d %s %d %03d\r' % (self._addr, 'TR', int(relay_id), time_tenths_seconds_string)
-        else:
-            if address is not None and address in self._relay_addresses:
-                data = b'@ %02d %s %d %03d\r' % (address, 'TR', int(relay_id), time_tenths_seconds_string)
-            else:
-                raise KTA223Error("Sending command to invalid address {0}".format(address))
+        data = b'@ %02d %s %s\r' % (self._board_address(address), 'TR', _timed_relay_parameter(relay_id, time_seconds))
+        # The relay switches back by itself, the shadow can't follow that.
+        self.invalidate_relay_shadow(address)
 
         self.debug_print("\nSending command [%s" % data)
         self.send(data)
@@ -249,14 +346,149 @@ class KTA223(object):
                 else:
                     raise KTA223Error("Unknown relay state")
         else:
-            relay_states_by_address = collections.defaultdict(list)
+            relay_changes_by_address = collections.defaultdict(dict)
+            timed_commands = []
             for state in state_list:
-                relay_states_by_address[state['address']].append(state)
-            for address in relay_states_by_address.keys():
-                # Right now this is broken, see pivotal story.
-                state_dict = dict(map(lambda x: (x['relay'], KTA_RELAY_STATE_ON) if x['state'] == 'on'
-                                      else (x['relay'], KTA_RELAY_STATE_OFF), relay_states_by_address[address]))
-                self.set_multiple_relay_values(state_dict, address=address)
+                if state['state'] == 'on':
+                    relay_changes_by_address[state['address']][int(state['relay'])] = KTA_RELAY_STATE_ON
+                elif state['state'] == 'off':
+                    relay_changes_by_address[state['address']][int(state['relay'])] = KTA_RELAY_STATE_OFF
+                elif state['state'] == 'timed':
+                    timed_commands.append(('TR', _timed_relay_parameter(state['relay'], state['time_seconds']),
+                                           state['address']))
+                else:
+                    raise KTA223Error("Unknown relay state")
+            self.apply_relay_changes(relay_changes_by_address)
+            if timed_commands:
+                for _, _, address in timed_commands:
+                    self.invalidate_relay_shadow(address)
+                self.send_commands(timed_commands)
+
+    def apply_relay_changes(self, relay_changes_by_address):
+        """
+        Switch relays on several boards with one WR per board, all boards pipelined.  Boards whose relays are
+        already in the requested state are left alone.
+        :param relay_changes_by_address: {address: {relay (1-8): KTA_RELAY_STATE_xxx}}
+        :return: {board address: relay byte written}
+        """
+        changes_by_board = collections.defaultdict(dict)
+        for address, changes in relay_changes_by_address.items():
+            changes_by_board[self._board_address(address)].update(changes)
+        if self._pending_relay_changes is not None:
+            for board_address, changes in changes_by_board.items():
+                self._pending_relay_changes[board_address].update(changes)
+            return {}
+
+        # Boards that only get some of their relays changed need their current byte, from the shadow if we have
+        # a recent one.
+        stale = [board_address for board_address, changes in changes_by_board.items()
+                 if changes and len(changes) < RELAYS_PER_BOARD and self._shadow_byte(board_address) is None]
+        if stale:
+            self.resync_relay_shadow(stale)
+
+        new_bytes = {}
+        for board_address, changes in changes_by_board.items():
+            if not changes:
+                continue
+            current_byte = self._shadow_byte(board_address)
+            new_byte = _apply_relay_states(current_byte or 0, changes)
+            if new_byte != current_byte:
+                new_bytes[board_address] = new_byte
+        if not new_bytes:
+            return new_bytes
+
+        addresses = list(new_bytes)
+        try:
+            self.send_commands([('WR', new_bytes[address], address) for address in addresses])
+        except Exception:
+            for address in addresses:
+                self.invalidate_relay_shadow(address)
+            raise
+        for address in addresses:
+            self._set_shadow(address, new_bytes[address])
+        return new_bytes
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Collect relay changes and send them all at once, one WR per changed board, when the block ends:
+            with kta.transaction():
+                kta.turn_relay_on(1, address=1)
+                kta.turn_relay_off(3, address=2)
+                kta.set_multiple_relay_values({2: KTA_RELAY_STATE_ON, 5: KTA_RELAY_STATE_ON}, address=1)
+        Nothing is sent if the block raises.  A transaction inside a transaction joins the outer one.
+        """
+        if self._pending_relay_changes is not None:
+            yield
+            return
+        self._pending_relay_changes = collections.defaultdict(dict)
+        try:
+            yield
+            changes = self._pending_relay_changes
+        finally:
+            self._pending_relay_changes = None
+        self.apply_relay_changes(changes)
+
+    def _shadow_byte(self, board_address):
+        # The remembered relay byte, None if we don't have a recent one.
+        entry = self._relay_shadow.get(board_address)
+        if entry is None or time.time() - entry[1] > RELAY_SHADOW_MAX_AGE:
+            return None
+        return entry[0]
+
+    def _set_shadow(self, board_address, byte_val):
+        self._relay_shadow[board_address] = [byte_val, time.time()]
+
+    def invalidate_relay_shadow(self, address=None):
+        """Forget the remembered relay byte of a board, or of all boards if address is None."""
+        if address is None:
+            self._relay_shadow.clear()
+        else:
+            self._relay_shadow.pop(self._board_address(address), None)
+
+    def resync_relay_shadow(self, addresses=None):
+        """
+        Read the relay byte of the given boards (default: all of them) in one pipelined batch.
+        :return: {board address: relay byte}
+        """
+        if addresses is None:
+            addresses = self._relay_addresses if self._relay_addresses is not None else [self._addr]
+        addresses = [self._board_address(address) for address in addresses]
+        replies = self.send_commands([('RS', 0, address) for address in addresses])
+        relay_bytes = {}
+        for address, reply in zip(addresses, replies):
+            relay_bytes[address] = self._parse_relay_byte(reply)
+            self._set_shadow(address, relay_bytes[address])
+        return relay_bytes
+
+    def _parse_relay_byte(self, reply):
+        value = _cook_output_string(reply)
+        if self._port == "FAKE":
+            return 0
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise KTA223Error("Bad relay status reply: {0!r}".format(reply))
+
+
+def _apply_relay_states(byte_val, channel_state_dict):
+    for channel_num, state in channel_state_dict.items():
+        if state == KTA_RELAY_STATE_ON:
+            byte_val |= (1 << (channel_num - 1))
+        elif state == KTA_RELAY_STATE_OFF:
+            byte_val &= (~(1 << (channel_num - 1)))
+    return byte_val & 0xFF
+
+
+def _relay_states_from_byte(byte_val):
+    return dict((channel, KTA_RELAY_STATE_ON if byte_val & (1 << (channel - 1)) else KTA_RELAY_STATE_OFF)
+                for channel in range(1, RELAYS_PER_BOARD + 1))
+
+
+def _timed_relay_parameter(relay_id, time_seconds):
+    if time_seconds > 25.5:
+        raise KTA223Error("Cannot set timed relay for longer than 25.5s")
+    return '%d %03d' % (int(relay_id), time_seconds * 10)
 
 
 class FakeSerial(object):
@@ -3,12 +3,22 @@ import serial
 import array
 import struct
 import csv
+import collections
 import contextlib
+import math
+import sys
+import threading
 
+import instrument_executor
 import webpower
 
 _HOMING_TIMEOUT = 30
-_POLL_DELAY = 0.5
+_POLL_DELAY = 0.5  # longest interval between status polls
+_MIN_POLL_DELAY = 0.005  # first interval between status polls, doubles up to _POLL_DELAY
+_POLL_BACKOFF = 2
+_PREDICTION_LEAD = 0.9  # start polling when this fraction of the predicted move time has passed
+_PREDICTION_SMOOTHING = 0.2  # weight of the latest move in the actual/predicted correction
+_MOVE_LOG_LENGTH = 1000
 _MOVE_TIMEOUT = 30
 _ERROR_DECEL = 1  # m/s/s
 
@@ -36,11 +46,128 @@ _ACCELERATION_CORRECTION = 100000
 _POSITION_CORRECTION = 10000
 _VELOCITY_CORRECTION = 1000000
 
+# Motion command telegram: header, sub id/count, master id, position, velocity, acceleration, deceleration, end.
+_MOVE_TELEGRAM = struct.Struct('<BBBBBBBBiiiiB')
+_MOVE_TELEGRAM_COUNT_OFFSET = 6
+# Sub ids of the VAI (master id 0x01) motion commands: Go To Pos (010xh) starts right away, Go To Pos After
+# Actual Command (018xh) is buffered by the drive and started as soon as the current motion is done.
+_GO_TO_POS_SUB_ID = 0x00
+_GO_TO_POS_AFTER_ACTUAL_SUB_ID = 0x80
+
 
 class LinmotAsfException(Exception):
     pass
 
 
+# Timing of one completed move: predicted is what predict_move_time() said (None if the start position was
+# unknown), actual is command sent -> in position reported.
+MoveTiming = collections.namedtuple('MoveTiming', 'position velocity acceleration predicted actual')
+
+
+def pack_move_telegram(pos, vel, accel, count=0, after_actual=False):
+    """Motion command telegram for a move to pos (mm) at vel (m/s) and accel (m/s/s), as a bytearray whose
+    count (low nibble of _MOVE_TELEGRAM_COUNT_OFFSET) is filled in when it is sent.  after_actual makes the
+    drive buffer the move and start it when the one in progress is done.
+    """
+    _check_profile(vel, accel)
+    sub_id = _GO_TO_POS_AFTER_ACTUAL_SUB_ID if after_actual else _GO_TO_POS_SUB_ID
+    return bytearray(_MOVE_TELEGRAM.pack(0x01, 0x00, 0x15, 0x02, 0x00, 0x02, sub_id | count, 0x01,
+                                         int(pos * _POSITION_CORRECTION),
+                                         int(vel * _VELOCITY_CORRECTION),
+                                         int(accel * _ACCELERATION_CORRECTION),
+                                         int(accel * _ACCELERATION_CORRECTION),
+                                         0x04))
+
+
+def read_move_csv(path):
+    """Read a test CSV (header line, then repetitions, from position, to position, velocity, acceleration)
+    into a list of [repetitions, from, to, velocity, acceleration] rows of floats.
+    """
+    tests = []
+    with open(path, 'rb') as testfile:
+        testfile.readline()  # skip column headers
+        test_lines = csv.reader(testfile, delimiter=',')
+        for test_line in test_lines:
+            tests.append([float(x) for x in test_line[:5]])
+    return tests
+
+
+def moves_from_tests(tests):
+    # Expand test rows into the (pos, vel, accel) moves main() makes: from, to, back to from, per repetition.
+    moves = []
+    for repetitions, from_pos, to_pos, velocity, acceleration in tests:
+        for _ in xrange(int(repetitions)):
+            for pos in (from_pos, to_pos, from_pos):
+                moves.append((int(pos), velocity, acceleration))
+    return moves
+
+
+def predict_move_time(distance, vel, accel):
+    """Seconds a trapezoidal (or, for short moves, triangular) profile takes to cover distance, in the same
+    units as vel (per second) and accel (per second squared).
+    """
+    _check_profile(vel, accel)
+    distance = abs(distance)
+    if distance == 0:
+        return 0.0
+    if distance >= vel * vel / accel:
+        # accelerate to vel, cruise, decelerate
+        return distance / vel + vel / accel
+    # never reaches vel
+    return 2 * math.sqrt(distance / accel)
+
+
+def _check_profile(vel, accel):
+    if vel <= 0 or accel <= 0:
+        raise LinmotAsfException('Velocity and acceleration must be positive, got %r m/s and %r m/s/s' %
+                                 (vel, accel))
+
+
+class _PollSchedule(object):
+    # Sleep intervals for status polling: wait out most of the predicted time first, then poll tightly and
+    # back off toward _POLL_DELAY.
+
+    def __init__(self, predicted=None):
+        self._first_delay = None if predicted is None else predicted * _PREDICTION_LEAD
+        self._delay = _MIN_POLL_DELAY
+
+    def next_delay(self):
+        if self._first_delay is not None:
+            delay, self._first_delay = self._first_delay, None
+            return delay
+        delay = self._delay
+        self._delay = min(self._delay * _POLL_BACKOFF, _POLL_DELAY)
+        return delay
+
+
+class _MoveFuture(instrument_executor.InstrumentFuture):
+    # Remembers whether the move's outcome has been handed to a caller, so the driver doesn't raise a failed
+    # move's error again on the next move.  cancel() makes the waiter thread give up at its next poll.
+
+    def __init__(self):
+        instrument_executor.InstrumentFuture.__init__(self, 'LinmotAsf.move_to')
+        self.delivered = False
+        self.cancelled = threading.Event()
+        self.waiter = None
+
+    def cancel(self):
+        # Fails the future with LinmotAsfException and returns once the waiter thread is gone.
+        self.cancelled.set()
+        if self.waiter is not None and self.waiter is not threading.current_thread():
+            self.waiter.join()
+
+    def result(self, timeout=None):
+        try:
+            return instrument_executor.InstrumentFuture.result(self, timeout)
+        finally:
+            self.delivered = self.done()
+
+    def exception(self, timeout=None):
+        exception = instrument_executor.InstrumentFuture.exception(self, timeout)
+        self.delivered = True
+        return exception
+
+
 @contextlib.contextmanager
 def make_linmot_asf(linmot_asf_port, web_power_url, web_power_outlet, verbose=False):
     asf = LinmotAsf(linmot_asf_port, web_power_url, web_power_outlet, verbose)
@@ -68,6 +195,13 @@ class LinmotAsf(object):
         self._linmot_asf_port = linmot_asf_port
         self._verbose = verbose
         self._read_error = False
+        # One request/response at a time: a move_to_async() waiter polls from its own thread.
+        self._io_lock = threading.RLock()
+        self._position = None  # mm, from the last status response
+        self._motion = None  # InstrumentFuture of the move in progress
+        self._count = None  # count of the last motion command we sent, None when it has to be read back
+        self._prediction_correction = 1.0  # running actual/predicted ratio
+        self.move_log = collections.deque(maxlen=_MOVE_LOG_LENGTH)
 
     def __del__(self):
         self.close()
@@ -92,17 +226,17 @@ class LinmotAsf(object):
             self._web_power.turn_port_on(self._web_power_outlet)
             time.sleep(5)
 
+        self._cancel_motion()
         self.clear_lock_state()
-        self._write_serial(_HOME_COMMAND)
-        self._read_response()
+        self._transact(_HOME_COMMAND)
 
         homed = False
         now = time.time()
         start = now
+        poll_schedule = _PollSchedule()
 
         while (now - start) < _HOMING_TIMEOUT:
-            self._write_serial(_HOME_COMMAND)
-            response_bytes = self._read_response()
+            response_bytes = self._transact(_HOME_COMMAND)
             status = struct.unpack('<BBBBBBBBBBBiiB', response_bytes)
 
             if (status[_STATE_OFFSET_IN_RESPONSE] != _HOMING_STATE) and \
@@ -114,7 +248,7 @@ class LinmotAsf(object):
                 homed = True
                 break
 
-            time.sleep(_POLL_DELAY)
+            time.sleep(poll_schedule.next_delay())
             now = time.time()
 
         if not homed:
@@ -123,64 +257,176 @@ class LinmotAsf(object):
         self.enable_operation()
 
     def move_to(self, pos, vel, accel):
+        self.move_to_async(pos, vel, accel)
+        self.wait_for_motion()
+
+    def move_to_async(self, pos, vel, accel):
+        """Start a move and return an InstrumentFuture that completes when the motor reports it is in position
+        (result() raises LinmotAsfException on timeout).  A move started while another one is in progress
+        waits for that one to finish first.
+        """
+        return self._start_move(pack_move_telegram(pos, vel, accel), (pos, vel, accel))
+
+    def run_sequence(self, moves):
+        """Run a list of (pos, vel, accel) moves back to back.  All telegrams are packed up front and go out in
+        pairs: the second move of a pair is sent as soon as the drive acknowledged the first, as a Go To Pos
+        After Actual Command, so the drive starts it by itself without waiting for a status poll.  The drive
+        buffers one command, so the next pair is sent once the second move is in position.
+
+        Returns the MoveTiming of every move; the first move of a pair has no actual time of its own, the
+        second one's covers the whole pair.
+        """
+        self.wait_for_motion()
+        telegrams = [pack_move_telegram(pos, vel, accel, after_actual=index % 2 == 1)
+                     for index, (pos, vel, accel) in enumerate(moves)]
+        timings = []
+        for index in xrange(0, len(moves), 2):
+            pair = moves[index:index + 2]
+            start_position = self._position
+            start = time.time()
+            for telegram in telegrams[index:index + 2]:
+                count = self._send_move_telegram(telegram)
+
+            predicted = None
+            if start_position is not None:
+                predicted = 0.0
+                for pos, vel, accel in pair:
+                    predicted += predict_move_time((pos - start_position) / 1000.0, vel, accel)
+                    start_position = pos
+            previous_target = None
+            if len(pair) == 2:
+                previous_target = pair[0][0]
+                timing = MoveTiming(pair[0][0], pair[0][1], pair[0][2], None, None)
+                self.move_log.append(timing)
+                timings.append(timing)
+            timings.append(self._wait_in_position(count, start, pair[-1], predicted, previous_target))
+        return timings
+
+    def _send_move_telegram(self, telegram):
+        # Fill in the next count and send the telegram; returns the count.
         count = self._get_next_count()
+        telegram[_MOVE_TELEGRAM_COUNT_OFFSET] = (telegram[_MOVE_TELEGRAM_COUNT_OFFSET] & ~_COUNT_MASK) | count
+        try:
+            self._transact(telegram)
+        except Exception:
+            self._count = None
+            raise
+        return count
 
-        payload = [0x01, 0x00, 0x15, 0x02, 0x00, 0x02]
-
-        for byte in struct.pack('B', count):
-            payload.append(ord(byte))
-
-        payload.append(0x01)
-
-        for byte in struct.pack('<i', pos * _POSITION_CORRECTION):
-            payload.append(ord(byte))
-
-        for byte in struct.pack('<i', vel * _VELOCITY_CORRECTION):
-            payload.append(ord(byte))
-
-        for byte in struct.pack('<i', accel * _ACCELERATION_CORRECTION):
-            payload.append(ord(byte))
-
-        for byte in struct.pack('<i', accel * _ACCELERATION_CORRECTION):
-            payload.append(ord(byte))
-
-        payload.append(0x04)
-
-        self._write_serial(payload)
-        self._read_response()
+    def _start_move(self, telegram, move):
+        self.wait_for_motion()
+        pos, vel, accel = move
+        predicted = None
+        if self._position is not None:
+            # position is in mm, vel in m/s and accel in m/s/s
+            predicted = predict_move_time((pos - self._position) / 1000.0, vel, accel)
 
+        count = self._send_move_telegram(telegram)
         start = time.time()
-        while (time.time() - start) < _MOVE_TIMEOUT:
+
+        future = _MoveFuture()
+        self._motion = future
+        future.waiter = threading.Thread(target=future._run,  # pylint: disable=W0212
+                                         args=(self._wait_in_position, (count, start, move, predicted),
+                                               {'cancelled': future.cancelled}),
+                                         name='LinmotAsfMotion')
+        future.waiter.daemon = True
+        future.waiter.start()
+        return future
+
+    def wait_for_motion(self, timeout=None):
+        # Block until the move in progress (if any) is done.  Re-raises its error, unless that was already
+        # delivered through the move's future.  Either way the move is forgotten once it is done.
+        motion = self._motion
+        if motion is None:
+            return
+        if motion.delivered:
+            self._motion = None
+            return
+        try:
+            motion.result(timeout)
+        finally:
+            if motion.done() and self._motion is motion:
+                self._motion = None
+
+    def predicted_move_time(self, pos, vel, accel):
+        """Seconds a move from the last known position to pos should take, corrected by how long previous
+        moves actually took.  None if the position is unknown.
+        """
+        if self._position is None:
+            return None
+        return predict_move_time((pos - self._position) / 1000.0, vel, accel) * self._prediction_correction
+
+    def _wait_in_position(self, count, start, move, predicted, previous_target=None, cancelled=None):
+        # previous_target: target of the move the drive runs before this one (see run_sequence).
+        # cancelled: Event set by stop() & co., ends the wait without touching the driver state.
+        corrected = None if predicted is None else predicted * self._prediction_correction
+        poll_schedule = _PollSchedule(corrected)
+        while True:
+            delay = poll_schedule.next_delay()
+            if cancelled is None:
+                time.sleep(delay)
+            elif cancelled.wait(delay):
+                raise LinmotAsfException('Move was cancelled.')
             if self._verbose:
                 print "polling"
             substate, state = self._get_default_response()
             if self._verbose:
                 print "gotdefaultresponse"
-            mask = _POSITION_MASK
-            moved = mask & substate
+            moved = _POSITION_MASK & substate
+            # The count tells the in position bit is about our command and not left over from the last one.
+            accepted = (_COUNT_MASK & substate) == count
+            if accepted and previous_target is not None and previous_target != move[0]:
+                # A buffered command's count is acknowledged right away; the in position bit may still be the
+                # previous move's, so we also have to be at our own target.
+                accepted = abs(self._position - move[0]) < abs(self._position - previous_target)
+
+            if (state == _OPERATION_ENABLED_STATE) and moved and accepted:
+                actual = time.time() - start
+                break
 
-            if (state == _OPERATION_ENABLED_STATE) and moved:
-                return
+            if (time.time() - start) >= _MOVE_TIMEOUT:
+                self._count = None
+                raise LinmotAsfException('Took too long to move.')
 
-            time.sleep(_POLL_DELAY)
+        if predicted:
+            self._prediction_correction += _PREDICTION_SMOOTHING * (actual / predicted -
+                                                                    self._prediction_correction)
+        timing = MoveTiming(move[0], move[1], move[2], corrected, actual)
+        self.move_log.append(timing)
+        return timing
 
-        raise LinmotAsfException('Took too long to move.')
+    def _cancel_motion(self):
+        # Fail the move in progress and wait for its waiter thread, so it can't touch the state of a newer move.
+        motion, self._motion = self._motion, None
+        if motion is not None:
+            motion.cancel()
 
     def stop(self):
-        self._write_serial(_STOP_COMMAND)
-        self._read_response()
+        self._cancel_motion()
+        self._count = None
+        self._transact(_STOP_COMMAND)
 
     def clear_lock_state(self):
-        self._write_serial(_CLEAR_LOCK_STATE_COMMAND)
-        self._read_response()
+        self._count = None
+        self._transact(_CLEAR_LOCK_STATE_COMMAND)
 
     def enable_operation(self):
-        self._write_serial(_ENABLE_OPERATION_COMMAND)
-        self._read_response()
+        self._cancel_motion()
+        self._count = None
+        self._transact(_ENABLE_OPERATION_COMMAND)
         time.sleep(2)
 
+    def _transact(self, input_bytes):
+        with self._io_lock:
+            self._write_serial(input_bytes)
+            return self._read_response()
+
     def _write_serial(self, input_bytes):
-        byte_string = array.array('B', input_bytes).tostring()
+        if isinstance(input_bytes, list):
+            byte_string = array.array('B', input_bytes).tostring()
+        else:
+            byte_string = str(input_bytes)
 
         if self._verbose:
             print('writing: ' + _string_from_bytes(byte_string))
@@ -223,26 +469,30 @@ class LinmotAsf(object):
         return response_bytes
 
     def _get_next_count(self):
-        substate, state = self._get_default_response()
+        # The drive only has to be asked for the first move after setup or an error, after that we know.
+        if self._count is None:
+            substate, state = self._get_default_response()
 
-        if state != _OPERATION_ENABLED_STATE:
-            raise LinmotAsfException('mainState was ' + str(state) + ', expected 0x08')
+            if state != _OPERATION_ENABLED_STATE:
+                raise LinmotAsfException('mainState was ' + str(state) + ', expected 0x08')
 
-        old_count = _COUNT_MASK & substate
-        count = (old_count + 1) % 16
+            self._count = _COUNT_MASK & substate
+            if self._verbose:
+                print('MainState = ' + str(state))
+
+        self._count = (self._count + 1) % 16
         if self._verbose:
-            print('Count:' + str(count))
-            print('MainState = ' + str(state))
+            print('Count:' + str(self._count))
 
-        return count
+        return self._count
 
     def _get_default_response(self):
-        self._write_serial(_REQUEST_DEFAULT_RESPONSE_COMMAND)
-        response_bytes = self._read_response()
+        response_bytes = self._transact(_REQUEST_DEFAULT_RESPONSE_COMMAND)
         status = struct.unpack('<BBBBBBBBBBBiiB', response_bytes)
 
         if self._verbose:
             print("location: " + str(status[_LOCATION_OFFSET_IN_RESPONSE]))
+        self._position = status[_LOCATION_OFFSET_IN_RESPONSE] / float(_POSITION_CORRECTION)
 
         substate = status[_SUBSTATE_OFFSET_IN_RESPONSE]
         state = status[_STATE_OFFSET_IN_RESPONSE]
@@ -254,12 +504,10 @@ def _string_from_bytes(input_bytes):
 
 
 def main():
-    tests = []
-    with open('test.csv', 'rb') as testfile:
-        testfile.readline()  # skip column headers
-        test_lines = csv.reader(testfile, delimiter=',')
-        for test_line in test_lines:
-            tests.append([float(x) for x in test_line[:5]])
+    # With --sequence every test row runs as one run_sequence() without stopping, otherwise it waits for
+    # return before each swipe.
+    sequence = '--sequence' in sys.argv[1:]
+    tests = read_move_csv('test.csv')
 
     with make_linmot_asf('/dev/cu.usbserial-FTVLVKEI', None, 4, False) as test_asf:
         test_asf.setup_motor()
@@ -270,6 +518,10 @@ def main():
 
         for test in tests:
             print test
+            if sequence:
+                for timing in test_asf.run_sequence(moves_from_tests([test])):
+                    print timing
+                continue
             from_pos = int(test[1])
             to_pos = int(test[2])
             velocity = float(test[3])
@@ -283,5 +535,4 @@ def main():
 
 
 if __name__ == '__main__':
-    import sys
     sys.exit(main())
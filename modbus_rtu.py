@@ -0,0 +1,192 @@
+import struct
+import time
+
+import serial
+import crc16
+
+# Modbus RTU master.
+#
+# Talks to one or more slaves on a serial line (RS-232 point to point or an RS-485 multi-drop bus), using an
+# already opened pyserial port:
+#
+#   port = serial.Serial('/dev/ttyUSB0', 9600, timeout=1)
+#   bus = ModbusRtuMaster(port)
+#   setpoint, pv = bus.read_holding_registers(1, 0x64, 2)
+#   bus.write_single_register(2, 0x12C, 250)
+#
+# Responses are framed by length: the function code tells how many bytes to expect, so we never wait for a
+# read timeout to find the end of a frame.  Between frames the bus is kept silent for 3.5 character times as the
+# spec requires, otherwise slaves glue two frames together.
+
+READ_HOLDING_REGISTERS = 0x03
+READ_INPUT_REGISTERS = 0x04
+WRITE_SINGLE_REGISTER = 0x06
+WRITE_MULTIPLE_REGISTERS = 0x10
+
+BROADCAST_ADDRESS = 0
+
+# Protocol limits per request.
+MAX_READ_REGISTERS = 125
+MAX_WRITE_REGISTERS = 123
+
+# Above 19200 baud the spec fixes the inter-frame gap instead of scaling it with the baud rate.
+FIXED_INTER_FRAME_DELAY = 0.00175  # seconds
+FIXED_INTER_FRAME_DELAY_MIN_BAUDRATE = 19200
+
+# Slaves don't answer broadcasts; give them this long to act on one before the next frame.
+BROADCAST_TURNAROUND_DELAY = 0.1  # seconds
+
+EXCEPTION_CODE_NAMES = {
+    0x01: "illegal function",
+    0x02: "illegal data address",
+    0x03: "illegal data value",
+    0x04: "slave device failure",
+    0x05: "acknowledge",
+    0x06: "slave device busy",
+    0x08: "memory parity error",
+    0x0A: "gateway path unavailable",
+    0x0B: "gateway target device failed to respond",
+}
+
+
+class ModbusError(Exception):
+    pass
+
+
+class ModbusTimeoutError(ModbusError):
+    pass
+
+
+class ModbusExceptionResponse(ModbusError):
+    # The slave understood the request and refused it.
+
+    def __init__(self, slave_address, function_code, exception_code):
+        self.slave_address = slave_address
+        self.function_code = function_code
+        self.exception_code = exception_code
+        ModbusError.__init__(self, "Slave {0} rejected function 0x{1:02X}: exception 0x{2:02X} ({3})".format(
+            slave_address, function_code, exception_code, EXCEPTION_CODE_NAMES.get(exception_code, "unknown")))
+
+
+def character_time(port):
+    # Seconds on the wire for one character: start bit, data bits, parity bit (if any), stop bits.
+    bits = 1 + port.bytesize + (0 if port.parity == serial.PARITY_NONE else 1) + port.stopbits
+    return float(bits) / port.baudrate
+
+
+def inter_frame_delay(port):
+    if port.baudrate > FIXED_INTER_FRAME_DELAY_MIN_BAUDRATE:
+        return FIXED_INTER_FRAME_DELAY
+    return 3.5 * character_time(port)
+
+
+def build_frame(slave_address, pdu):
+    frame = chr(slave_address) + pdu
+    return frame + struct.pack('<H', crc16.calculate(frame))
+
+
+def _check_register_values(values):
+    # Registers are unsigned 16 bit; signed values have to be converted by the caller (value & 0xFFFF).
+    for value in values:
+        if not 0 <= value <= 0xFFFF:
+            raise ModbusError("Register value {0} is outside 0..0xFFFF".format(value))
+
+
+class ModbusRtuMaster(object):
+
+    def __init__(self, port):
+        self._port = port
+        self._last_frame_time = 0
+
+    def read_holding_registers(self, slave_address, start_address, count):
+        return self._read_registers(READ_HOLDING_REGISTERS, slave_address, start_address, count)
+
+    def read_input_registers(self, slave_address, start_address, count):
+        return self._read_registers(READ_INPUT_REGISTERS, slave_address, start_address, count)
+
+    def write_single_register(self, slave_address, register_address, value):
+        _check_register_values([value])
+        pdu = struct.pack('>BHH', WRITE_SINGLE_REGISTER, register_address, value)
+        response = self.transact(slave_address, pdu, 4)
+        if response is not None and response != pdu[1:]:
+            raise ModbusError("Slave {0} echoed a different write: {1!r}".format(slave_address, response))
+
+    def write_multiple_registers(self, slave_address, start_address, values):
+        values = list(values)
+        if not 1 <= len(values) <= MAX_WRITE_REGISTERS:
+            raise ModbusError("Can write 1 to {0} registers at once, not {1}".format(MAX_WRITE_REGISTERS,
+                                                                                      len(values)))
+        _check_register_values(values)
+        pdu = struct.pack('>BHHB{0}H'.format(len(values)), WRITE_MULTIPLE_REGISTERS, start_address, len(values),
+                          2 * len(values), *values)
+        response = self.transact(slave_address, pdu, 4)
+        if response is not None and response != pdu[1:5]:
+            raise ModbusError("Slave {0} acknowledged a different write: {1!r}".format(slave_address, response))
+
+    def _read_registers(self, function_code, slave_address, start_address, count):
+        if slave_address == BROADCAST_ADDRESS:
+            raise ModbusError("Reads can't be broadcast")
+        if not 1 <= count <= MAX_READ_REGISTERS:
+            raise ModbusError("Can read 1 to {0} registers at once, not {1}".format(MAX_READ_REGISTERS, count))
+        pdu = struct.pack('>BHH', function_code, start_address, count)
+        # byte count + 2 bytes per register
+        response = self.transact(slave_address, pdu, 1 + 2 * count)
+        if ord(response[0]) != 2 * count:
+            raise ModbusError("Slave {0} returned {1} data bytes for {2} registers".format(
+                slave_address, ord(response[0]), count))
+        return list(struct.unpack('>{0}H'.format(count), response[1:]))
+
+    def transact(self, slave_address, pdu, response_data_length):
+        '''Send pdu (function code + data) to a slave and return the data part of its response, which must be
+        response_data_length bytes.  Broadcasts return None.
+        '''
+        self._wait_for_bus_idle()
+        self._port.flushInput()  # drop leftovers of an earlier, timed out transaction
+        self._port.write(build_frame(slave_address, pdu))
+        self._port.flush()
+
+        if slave_address == BROADCAST_ADDRESS:
+            self._last_frame_time = time.time() + BROADCAST_TURNAROUND_DELAY
+            return None
+
+        try:
+            return self._read_response(slave_address, ord(pdu[0]), response_data_length)
+        finally:
+            self._last_frame_time = time.time()
+
+    def _read_response(self, slave_address, function_code, response_data_length):
+        header = self._read_exactly(2, slave_address)
+        if ord(header[0]) != slave_address:
+            raise ModbusError("Expected a response from slave {0}, got one from {1}".format(
+                slave_address, ord(header[0])))
+
+        if ord(header[1]) == function_code | 0x80:
+            body = self._read_exactly(1 + 2, slave_address)
+            self._check_crc(header + body, slave_address)
+            raise ModbusExceptionResponse(slave_address, function_code, ord(body[0]))
+        if ord(header[1]) != function_code:
+            raise ModbusError("Slave {0} answered function 0x{1:02X} with function 0x{2:02X}".format(
+                slave_address, function_code, ord(header[1])))
+
+        body = self._read_exactly(response_data_length + 2, slave_address)
+        self._check_crc(header + body, slave_address)
+        return body[:-2]
+
+    def _read_exactly(self, size, slave_address):
+        data = self._port.read(size)
+        if len(data) < size:
+            if not data:
+                raise ModbusTimeoutError("Slave {0} did not respond".format(slave_address))
+            raise ModbusTimeoutError("Slave {0} sent a truncated response: {1!r}".format(slave_address, data))
+        return data
+
+    @staticmethod
+    def _check_crc(frame, slave_address):
+        # The CRC over a frame including its own (little endian) CRC is 0.
+        if crc16.calculate(frame) != 0:
+            raise ModbusError("Bad CRC in response from slave {0}: {1!r}".format(slave_address, frame))
+
+    def _wait_for_bus_idle(self):
+        remaining = self._last_frame_time + inter_frame_delay(self._port) - time.time()
+        if remaining > 0:
+            time.sleep(remaining)
@@ -32,13 +32,13 @@ MEASUREMENT_CONFIGURATIONS = {
         #Note: documentation on CONF command says basically "pick whatever you want" for VOLT and RES ranges
         # but elsewhere in the doc (specifically SENS:FREQ:VOLT:RANGE), it's listed as being discreet.
         'valid_range_strings': ("100", "1000", "10000", "100000", "1000000", "10000000", "100000000"),  # 10E+2 to 10E+8
-        'valid_measurement_subtypes': (None)
+        'valid_measurement_subtypes': (None,)
     },
     'frequency': {
         'scpi_mnemonic': "FREQ",
         'valid_range_strings': ("3", "30", "300", "3000", "30000", "300000"),  # 3Hz to 300 kHz
         #VALID_PERIOD_RANGE_STRINGS= # per documentation: 1/VALID_HZ_RANGE_STRING
-        'valid_measurement_subtypes': (None)
+        'valid_measurement_subtypes': (None,)
     }
     # later: 4-wire resistance FRES, temperature TEMP, period PER, digital:byte DIG:BYTE, totalize TOT
 }
@@ -100,7 +100,7 @@ class Agilent34970Mux(visa_instrument.VisaInstrument):
         #make dmm chassis aware of which cards it has in which slots.
         self._card_info = {}
         for slot in ("100", "200", "300"):
-            self._card_info[slot] = self.query_card_type(slot)
+            self._card_info[slot] = self.cached_query("card_info_" + slot, lambda slot=slot: self.query_card_type(slot))
             if DO_DEBUG_PRINT:
                 print "\nSlot {0}:".format(slot)
                 print self._card_info[slot]
@@ -183,8 +183,13 @@ class Agilent34970Mux(visa_instrument.VisaInstrument):
     #   Once we have a good reason to use it, we can add it in with a default value of 'default' to keep the interface
     #   backwards-compatible
     def configure_measurement(self, measurement_type, channel_list_string, measurement_range_string, measurement_subtype=None):
+        return self.write(self._build_configure_command(measurement_type, channel_list_string,
+                                                        measurement_range_string, measurement_subtype))
 
-        self._validate_measurement_parameters(measurement_type, measurement_range_string, measurement_subtype)
+    @classmethod
+    def _build_configure_command(cls, measurement_type, channel_list_string, measurement_range_string, measurement_subtype=None):
+
+        cls._validate_measurement_parameters(measurement_type, measurement_range_string, measurement_subtype)
 
         # base string
         scpi_command_string = ("CONF:{0}".format(MEASUREMENT_CONFIGURATIONS[measurement_type]['scpi_mnemonic']))
@@ -197,7 +202,7 @@ class Agilent34970Mux(visa_instrument.VisaInstrument):
         # NOTE for future reference: if adding the resolution, need comma before and after:   range,RES, (@channels)
         scpi_command_string = scpi_command_string + ",DEF,(@" + channel_list_string + ")"
 
-        return self.write(scpi_command_string)
+        return scpi_command_string
 
     def set_scan_list(self, channel_list_string):
         return self.write("ROUT:SCAN (@{0})".format(channel_list_string))
@@ -210,6 +215,43 @@ class Agilent34970Mux(visa_instrument.VisaInstrument):
         reading = self.read()
         float_reading = float(reading)
         return float_reading
+
+    #####################################################################
+    # Sweep: measure a whole board's worth of channels in one scan.
+    #####################################################################
+
+    # channel_plan maps channel -> (measurement_type, measurement_range_string[, measurement_subtype]), e.g.
+    #   {'214': ('voltage', '10', 'DC'), '121': ('current', '0.1', 'DC'), '301': ('resistance', '10000')}
+    # Channels sharing a configuration get one CONF command, everything goes out as one batch together
+    # with a single ROUT:SCAN, and one READ? brings all readings back.
+    # Returns {channel: reading}.
+    def sweep(self, channel_plan):
+        if not channel_plan:
+            raise InvalidArgException("Empty channel plan.")
+
+        channels_by_configuration = {}
+        for channel, configuration in channel_plan.items():
+            if len(configuration) == 2:
+                configuration = (configuration[0], configuration[1], None)
+            channels_by_configuration.setdefault(tuple(configuration), []).append(str(channel))
+
+        # The instrument always scans in ascending channel order, whatever order the scan list is in.
+        # (Channel numbers are always 3 digits, so sorting the strings sorts them numerically.)
+        caller_channels = dict((str(channel), channel) for channel in channel_plan)
+        scan_channels = sorted(caller_channels)
+
+        with self.batch():
+            for (measurement_type, measurement_range_string, measurement_subtype), channels in \
+                    sorted(channels_by_configuration.items()):
+                self.send_command_and_check_error(
+                    self._build_configure_command(measurement_type, ','.join(sorted(channels)),
+                                                  measurement_range_string, measurement_subtype))
+            self.send_command_and_check_error("ROUT:SCAN (@{0})".format(','.join(scan_channels)))
+
+        readings = self.read_readings()
+        if len(readings) != len(scan_channels):
+            raise MuxError("Expected {0} readings from scan, got {1}.".format(len(scan_channels), len(readings)))
+        return dict((caller_channels[channel], reading) for channel, reading in zip(scan_channels, readings))
     
 
 def main():
@@ -217,25 +259,10 @@ def main():
     instr = Agilent34970Mux(id)
     print instr.identification_query()
     
-    measurement_type = 'voltage'
-    measurement_range_string = '10'
-    measurement_subtype = 'DC'
-    channel_list_string = '214'
-    instr.configure_measurement(measurement_type, channel_list_string, measurement_range_string, measurement_subtype)
-    instr.set_scan_list(channel_list_string)
-    voltage = instr.read_one_reading()
-    print type(voltage)
-    print voltage
-
-    measurement_type = 'current'
-    measurement_range_string = '0.1'
-    measurement_subtype = 'DC'
-    channel_list_string = '121'
-    instr.configure_measurement(measurement_type, channel_list_string, measurement_range_string, measurement_subtype)
-    instr.set_scan_list(channel_list_string)
-    current = instr.read_one_reading()
-    print type(current)
-    print current
+    readings = instr.sweep({'214': ('voltage', '10', 'DC'),
+                            '121': ('current', '0.1', 'DC')})
+    print readings['214']
+    print readings['121']
 
 if __name__ == '__main__':
     main()
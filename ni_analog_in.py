@@ -4,9 +4,19 @@
 
 '''
 
+import array
+import base64
 import os
 import subprocess
-import csv
+import sys
+
+import ni_helper
+import signal_analysis
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 ENABLE_DEVICE = True
 ultrafinn_fullscale_voltage=5
@@ -20,14 +30,19 @@ class NIAnalogIn(object):
 
     def __init__(self,
                  ni_device_id=2,  # device id is 2 on LAB PC for NI DAQ 6211: PLEASE CHECK!
-                 binary_path="recordSwipe.exe"):  # CHECK path!
+                 binary_path="recordSwipe.exe",  # CHECK path!
+                 persistent=False, helper_command=None):
         self._dev = "Dev%d" % ni_device_id
         self._binary_path = binary_path
         self._is_debug_enabled = False
-        self._tempfile = {'0': "", '1': "", '2': "", '3': ""}
+        # persistent: keep one recordSwipe --serve process running (see ni_helper), which sends the samples
+        # back over its pipe instead of through a CSV file
+        self._persistent = persistent
+        self._helper_command = helper_command
+        self.samples = {}   # channel -> voltages of the last acquisition (numpy array, array.array without numpy)
         self.frequency_KHz = {'0': None, '1': None, '2': None, '3': None}
         self.mean_volt = {'0': None, '1': None, '2': None, '3': None}
-        if not os.path.isfile(binary_path):
+        if helper_command is None and not os.path.isfile(binary_path):
             raise NIAnalogInException("Binary path does not exist.")
 
     def enable_debug(self, enable=True):
@@ -65,12 +80,15 @@ class NIAnalogIn(object):
             if i < 0 or i > 15:
                 raise NIAnalogInException("Channel value must be [0..15]")
             else:
-                self._acquire_samples(sample_time, i, 250000)
-                self._compute_freq(i)
-                self._average_squarewave(i)
+                self.samples[i] = self._acquire_samples(sample_time, i, 250000)
+                self.frequency_KHz[i], self.mean_volt[i] = _analyze_squarewave(self.samples[i], sample_time)
 
     def _acquire_samples(self, sample_time=1, channel=1, sample_frequency=48000):
-        channel_name_str = "AI" % channel
+        channel_name_str = "AI%d" % channel
+        if self._persistent and ENABLE_DEVICE:
+            return self._stream_samples(self._dev + "/" + channel_name_str, sample_frequency, sample_time)
+
+        # The exe can only hand its samples over in a file: read it in one pass and remove it.
         tempfile = "samples_channel%d.csv" % channel
         if os.path.isfile(tempfile):
             os.remove(tempfile)
@@ -85,55 +103,32 @@ class NIAnalogIn(object):
                        str(sample_frequency) +
                        " -a " +
                        str(sample_time))
-        self._tempfile[channel] = tempfile
         (output, exit_code) = self._dispatch(call_string)
         if not exit_code == 0:
             raise NIAnalogInException("Util returned a non-zero value: [%d:%s]" % (exit_code, output))
         elif not os.path.isfile(tempfile):
             raise NIAnalogInException("Output File does not exist")
-        else:
-            return 0
-
-    # This method assumes that the CSV file has a header row, which is the default for NI DAQs
-    def _compute_freq(self, channel):
-        signal = []
-        with open(self._tempfile[channel], "rb") as csvfile:
-            logreader = csv.reader(csvfile, delimiter=',')
-            i = 0
-            for row in logreader:
-                i += 1
-                if i == 1:  # skip header row
-                    continue
-                rownew = row[1][1:]
-                signal.append(int(round(float(rownew))))
-        q = 1
-        no_of_transitions = 0  # from low to high
-        for i in signal:
-            q += 1
-            if q > (signal.__len__() - 1):
-                break
-            if signal[q] == 0 and signal[q-1] != 0:
-                no_of_transitions += 1
-        self.frequency_KHz[channel] = (float(no_of_transitions) / 1000)
-
-    def _average_squarewave(self, channel):
-        signal = []
-        with open(self._tempfile[channel], "rb") as csvfile:
-            logreader = csv.reader(csvfile, delimiter=',')
-            i = 0
-            for row in logreader:
-                i += 1
-                if i == 1:
-                    continue
-                rownew = row[1][1:]
-                signal.append(int(round(float(rownew))))
-        high = 0
-        all = 0
-        for i in signal:
-            all += 1
-            if i > ultrafinn_logic_high_threshold_voltage:
-                high += 1
-        self.mean_volt[channel] = ((float(high) / float(all)) * ultrafinn_fullscale_voltage)
+        try:
+            return _read_samples_csv(tempfile)
+        finally:
+            os.remove(tempfile)
+
+    def _stream_samples(self, channel, sample_frequency, sample_time):
+        command = self._helper_command or [self._binary_path, ni_helper.HELPER_ARGUMENT]
+        try:
+            result = ni_helper.get_helper(command).request("stream_samples", channel=channel,
+                                                           rate=sample_frequency, time=sample_time)
+        except ni_helper.NIHelperException as the_exception:
+            raise NIAnalogInException("Helper error: [%s]" % the_exception)
+        # SAMPLES is base64 of little endian float64 voltages.
+        data = base64.b64decode(result["SAMPLES"])
+        if np is not None:
+            return np.frombuffer(data, dtype='<f8')
+        samples = array.array('d')
+        samples.fromstring(data)
+        if sys.byteorder != 'little':
+            samples.byteswap()
+        return samples
 
     def _dispatch(self, call_string):
         self._debug_print(call_string)
@@ -151,6 +146,26 @@ class NIAnalogIn(object):
         return (output, return_code)
 
 
+# NI DAQ CSV files have a header row, then "time, voltage" rows.
+def _read_samples_csv(path):
+    return signal_analysis.load_csv_capture(path)
+
+
+def _analyze_squarewave(samples, sample_time):
+    """Returns (frequency in kHz, average voltage of the square wave) of a capture.
+
+    Both use the hardware thresholds on the voltages rounded to whole volts: low is 0 V, high is above
+    ultrafinn_logic_high_threshold_voltage.  Edges need the signal to go all the way between the two, so ringing
+    near one threshold isn't counted.
+    """
+    if len(samples) == 0:
+        raise NIAnalogInException("No samples acquired")
+    high_threshold = ultrafinn_logic_high_threshold_voltage + 0.5
+    falling_edges = len(signal_analysis.find_edges(samples, 0.5, high_threshold)[1])
+    frequency_khz = float(falling_edges) / sample_time / 1000
+    return frequency_khz, signal_analysis.fraction_above(samples, high_threshold) * ultrafinn_fullscale_voltage
+
+
 def main():
     obj = NIAnalogIn()
     obj.acquire_and_compute([0, 1, 2, 3], 1)
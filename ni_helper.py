@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+'''Persistent helper processes for the NI DAQ utilities.
+
+Starting niFreqCtr.exe / niDioUtil.exe / recordSwipe.exe for every call costs process creation plus DAQmx task
+setup and teardown, often 100+ ms.  In helper mode the utility is started once per device with --serve and
+keeps running, answering requests over stdin/stdout, one JSON object per line:
+
+    request:   {"id": 7, "cmd": "read_byte", "args": {"port": "port0"}}
+    response:  {"id": 7, "result": {"BYTEVAL": "0x3F"}}
+    error:     {"id": 7, "error": "message", "code": -200474}
+
+Commands: measure_frequency, read_byte, write_byte, acquire_samples (writes a CSV file) and stream_samples,
+whose result carries the capture itself as {"SAMPLES": base64 of little endian float64 voltages}.
+
+Responses carry the id of their request and may come back in any order, so several threads can share one
+helper.  Closing stdin tells the helper to exit.  tests/fake_ni_helper.py implements the protocol without
+hardware, for trying the drivers on Linux:
+
+    dio = NIUSBDIO(1, persistent=True, helper_command=[sys.executable, 'tests/fake_ni_helper.py'])
+'''
+
+import json
+import subprocess
+import threading
+
+HELPER_ARGUMENT = "--serve"
+REQUEST_TIMEOUT = 30  # seconds
+
+
+class NIHelperException(Exception):
+    def __init__(self, message, code=None):
+        Exception.__init__(self, message)
+        self.code = code
+
+
+class _PendingRequest(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+
+
+class NIHelperProcess(object):
+    def __init__(self, command):
+        self._command = list(command)
+        self._process = None
+        self._reader = None
+        self._pending = {}  # request id -> _PendingRequest
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def request(self, cmd, timeout=REQUEST_TIMEOUT, **args):
+        '''Send cmd with keyword args to the helper and return its result dict.'''
+        pending = _PendingRequest()
+        with self._lock:
+            self._start()
+            process = self._process
+            request_id = self._next_id
+            self._next_id += 1
+            pending_by_id = self._pending
+            pending_by_id[request_id] = pending
+            try:
+                self._process.stdin.write(json.dumps({"id": request_id, "cmd": cmd, "args": args}) + "\n")
+                self._process.stdin.flush()
+            except (IOError, OSError) as the_exception:
+                del pending_by_id[request_id]
+                raise NIHelperException("Could not send to helper %s: %s" % (self._command[0], the_exception))
+
+        if not pending.done.wait(timeout):
+            with self._lock:
+                pending_by_id.pop(request_id, None)
+            # A helper that doesn't answer is wedged (e.g. stuck in DAQmx).  Kill it, which also fails the other
+            # requests waiting on it right away; the next request starts a fresh one.
+            self._stop(process, kill=True)
+            raise NIHelperException("Helper %s did not answer %s within %d s" % (self._command[0], cmd, timeout))
+        response = pending.response
+        if "error" in response:
+            raise NIHelperException(response["error"], response.get("code"))
+        return response.get("result", {})
+
+    def close(self):
+        with self._lock:
+            process = self._process
+        self._stop(process)
+
+    def _stop(self, process, kill=False):
+        # Stop process if it is still our current helper.
+        with self._lock:
+            if process is None or process is not self._process:
+                return
+            reader = self._reader
+            self._process = None
+            self._reader = None
+        if kill:
+            try:
+                process.kill()
+            except OSError:
+                # already gone
+                pass
+        else:
+            process.stdin.close()
+        process.wait()
+        reader.join()
+
+    def _start(self):
+        # Called with self._lock held.  (Re)starts the helper if it isn't running.
+        if self._process is not None and self._process.poll() is None:
+            return
+        try:
+            self._process = subprocess.Popen(self._command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        except OSError as the_exception:
+            raise NIHelperException("Could not start helper %s: %s" % (self._command[0], the_exception))
+        # Each process gets its own table, so a dying one only fails its own requests.
+        self._pending = {}
+        self._reader = threading.Thread(target=self._read_responses, args=(self._process, self._pending),
+                                         name="NIHelperReader")
+        self._reader.daemon = True
+        self._reader.start()
+
+    def _read_responses(self, process, pending_by_id):
+        for line in iter(process.stdout.readline, ""):
+            try:
+                response = json.loads(line)
+            except ValueError:
+                # Not protocol, e.g. a DAQmx message printed to stdout.  Ignore it.
+                continue
+            with self._lock:
+                pending = pending_by_id.pop(response.get("id"), None)
+            if pending is not None:
+                pending.response = response
+                pending.done.set()
+
+        # The helper exited: fail whatever is still waiting on it.  The next request starts a new one.
+        with self._lock:
+            pending_requests = list(pending_by_id.values())
+            pending_by_id.clear()
+        for pending in pending_requests:
+            pending.response = {"error": "Helper %s exited" % self._command[0]}
+            pending.done.set()
+
+
+_HELPERS = {}
+_HELPERS_LOCK = threading.Lock()
+
+
+def get_helper(command):
+    '''Return the helper process for command, starting one if needed.  Drivers for the same device share it.'''
+    key = tuple(command)
+    with _HELPERS_LOCK:
+        helper = _HELPERS.get(key)
+        if helper is None:
+            helper = NIHelperProcess(command)
+            _HELPERS[key] = helper
+        return helper
+
+
+def close_all():
+    with _HELPERS_LOCK:
+        helpers = _HELPERS.values()
+        _HELPERS.clear()
+    for helper in helpers:
+        helper.close()
@@ -10,6 +10,8 @@ import os
 import subprocess
 import json
 
+import ni_helper
+
 ENABLE_DEVICE = True
 
 
@@ -23,11 +25,14 @@ class NiUsbDioException(Exception):
 
 
 class NIUSBDIO(object):
-    def __init__(self, ni_device_id=1):  # format
+    def __init__(self, ni_device_id=1, persistent=False, helper_command=None):  # format
         self._dev = "Dev%d" % ni_device_id
         self._num_ports = 4
         self._util_path = "../bin/niDioUtil.exe"
         self._is_debug_enabled = False
+        # persistent: keep one niDioUtil --serve process running, so polling loops don't start an exe per read
+        self._persistent = persistent
+        self._helper_command = helper_command
 
     def enable_debug(self, enable=True):
         self._is_debug_enabled = enable
@@ -43,12 +48,21 @@ class NIUSBDIO(object):
 
     def write_byte(self, port_number, byteval):
         port_string = self.make_port_string(port_number)
-        self._check_user_byte(byteval)
+        byte_me = self._check_user_byte(byteval)
+        if self._persistent and ENABLE_DEVICE:
+            self._helper_request("write_byte", port=port_string, value=byte_me)
+            return
         callstring = self._util_path + " -d " + self._dev + " -p " + port_string + " -w " + str(byteval)
         self._dispatch(callstring)
 
     def read_byte(self, port_number):
         port_string = self.make_port_string(port_number)
+        if self._persistent and ENABLE_DEVICE:
+            obj = self._helper_request("read_byte", port=port_string)
+            if "BYTEVAL" not in obj:
+                raise NiUsbDioException("Unexpected response received from dio helper: [%s]" % obj)
+            return int(obj.get("BYTEVAL"), 16)
+
         call_string = self._util_path + " -d " + self._dev + " -p " + port_string + " -r "
         output, exit_code = self._dispatch(call_string)
         if not exit_code == 0:
@@ -78,7 +92,7 @@ class NIUSBDIO(object):
         if byte_me < 0 or byte_me > 255:
             raise NiUsbDioException("WriteByte: %s is not a valid byte." % str(byteval))
 
-        return
+        return byte_me
 
     def make_port_string(self, port_num):
         '''Take in a port number and convert to a string '''
@@ -87,6 +101,14 @@ class NIUSBDIO(object):
 
         return "port%d" % port_num
 
+    def _helper_request(self, cmd, **args):
+        command = self._helper_command or [self._util_path, ni_helper.HELPER_ARGUMENT, "-d", self._dev]
+        self._debug_print("%s %s" % (cmd, args))
+        try:
+            return ni_helper.get_helper(command).request(cmd, **args)
+        except ni_helper.NIHelperException as the_exception:
+            raise NiUsbDioException("NiDaq helper error: [%s]" % the_exception)
+
     def _dispatch(self, callstring):
 
         self._debug_print(callstring)
@@ -1,6 +1,24 @@
+import collections
 import sys
+import threading
+import time
+
 import serial
-import crc16
+import modbus_rtu
+
+# Registers of the oven's temperature controller.
+PROCESS_VALUE_REGISTER = 0x0064
+SETPOINT_REGISTER = 0x012C
+
+# The controller keeps temperatures as 16-bit two's complement tenths of a degree.
+TEMPERATURE_SCALE = 10.0
+MIN_TEMPERATURE = -0x8000 / TEMPERATURE_SCALE
+MAX_TEMPERATURE = 0x7FFF / TEMPERATURE_SCALE
+
+# Profile runner defaults.
+DEFAULT_SAMPLE_INTERVAL = 1.0       # seconds between PV reads
+DEFAULT_SOAK_TOLERANCE = 0.5        # +/- degrees C
+DEFAULT_SOAK_STABLE_TIME = 60.0     # seconds PV has to stay within tolerance
 
 
 class OvenException(Exception):
@@ -8,7 +26,7 @@ class OvenException(Exception):
 
 
 class Oven(object):
-    def __init__(self, oven_serial_port_path):
+    def __init__(self, oven_serial_port_path, slave_address=1):
         port = serial.Serial(oven_serial_port_path)
         port.setBaudrate(9600)
         port.setTimeout(5)
@@ -17,6 +35,10 @@ class Oven(object):
         port.flush()
         self._oven_serial_port = port
         self._oven_serial_port_path = oven_serial_port_path
+        self._modbus = modbus_rtu.ModbusRtuMaster(port)
+        self._slave_address = slave_address
+        # A TemperatureMonitor reads PV from its own thread while the caller writes setpoints.
+        self._lock = threading.Lock()
 
     def __del__(self):
         self.close()
@@ -26,56 +48,312 @@ class Oven(object):
             self._oven_serial_port.close()
             self._oven_serial_port = None
 
-    def read_temperature(self):
+    def read_registers(self, start_address, count):
+        # One transaction for a block of consecutive holding registers (setpoint, PV, ramp, alarms...).
         if not self._oven_serial_port:
             raise OvenException('No serial connection to oven (%s)' % self._oven_serial_port_path)
+        try:
+            with self._lock:
+                return self._modbus.read_holding_registers(self._slave_address, start_address, count)
+        except modbus_rtu.ModbusError as e:
+            raise OvenException('Oven did not respond correctly to register read.\n' + str(e))
 
-        request = b'\x01\x03\x00\x64\x00\x01\xC5\xD5'
-        self._oven_serial_port.write(request)
-        self._oven_serial_port.flush()
-
-        response = self._oven_serial_port.read(7)
-        if len(response) == 0:
-            raise OvenException('Oven did not respond to temperature request.')
-        if len(response) < 7:
-            raise OvenException('Oven did not respond correctly to temperature request.\nResponse: ' + str(response))
-
-        temperature = int(response[3:5].encode('hex'), 16) / 10.0
-        return temperature
-
-    def set_temperature(self, desired_temperature):
+    def write_registers(self, start_address, values):
         if not self._oven_serial_port:
             raise OvenException('No serial connection to oven (%s)' % self._oven_serial_port_path)
+        try:
+            with self._lock:
+                if len(values) == 1:
+                    self._modbus.write_single_register(self._slave_address, start_address, values[0])
+                else:
+                    self._modbus.write_multiple_registers(self._slave_address, start_address, values)
+        except modbus_rtu.ModbusError as e:
+            raise OvenException('Oven did not respond correctly to register write.\n' + str(e))
 
-        temp = int(desired_temperature * 10.0)
-        temp_low_byte = _get_low_byte(temp)
-        temp_high_byte = _get_high_byte(temp)
-
-        request = b'\x01\x06\x01\x2C' + chr(temp_high_byte) + chr(temp_low_byte)
-
-        crc = crc16.calculate_string(request)
-        crc_low_byte = _get_low_byte(crc)
-        crc_high_byte = _get_high_byte(crc)
-
-        request += chr(crc_low_byte) + chr(crc_high_byte)
-        self._oven_serial_port.write(request)
-        self._oven_serial_port.flush()
-
-        response = self._oven_serial_port.read(8)
-        self._oven_serial_port.flush()
-
-        if len(response) == 0:
-            raise OvenException('Oven did not respond to set temperature command.')
-        if len(response) < 8:
-            raise OvenException('Oven gave bad response to set temperature command.\nResponse: ' + str(response))
-
-
-def _get_low_byte(u16):
-    return u16 & 0xFF
-
+    def read_temperature(self):
+        return _temperature_from_register(self.read_registers(PROCESS_VALUE_REGISTER, 1)[0])
 
-def _get_high_byte(u16):
-    return (u16 >> 8) & 0xFF
+    def set_temperature(self, desired_temperature):
+        self.write_registers(SETPOINT_REGISTER, [_temperature_to_register(desired_temperature)])
+
+
+def _temperature_to_register(temperature):
+    if not MIN_TEMPERATURE <= temperature <= MAX_TEMPERATURE:
+        raise OvenException('Temperature %r is outside the controller range [%.1f, %.1f]' %
+                            (temperature, MIN_TEMPERATURE, MAX_TEMPERATURE))
+    return int(temperature * TEMPERATURE_SCALE) & 0xFFFF
+
+
+def _temperature_from_register(value):
+    if value & 0x8000:
+        value -= 0x10000
+    return value / TEMPERATURE_SCALE
+
+
+class TemperatureMonitor(object):
+    """Samples the oven's PV every sample_interval seconds in a background thread.
+
+    Keeps a rolling window of (timestamp, temperature) samples so callers can wait for the chamber to settle
+    instead of sleeping for a worst-case time:
+
+        with TemperatureMonitor(oven) as monitor:
+            oven.set_temperature(85)
+            monitor.wait_stable(85, tolerance=0.5, stable_time=60)
+    """
+
+    def __init__(self, oven, sample_interval=DEFAULT_SAMPLE_INTERVAL, window=3600.0):
+        self._oven = oven
+        self.sample_interval = sample_interval
+        # Enough samples to cover the longest stable_time anyone asks for.
+        self._samples = collections.deque(maxlen=int(window / sample_interval) + 1)
+        self._error = None
+        self._condition = threading.Condition()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._sample_loop, name="OvenTemperatureMonitor")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self._condition:
+            self._thread = None
+            # Wake waiters so they see the monitor is gone instead of sleeping out their timeout.
+            self._condition.notify_all()
+
+    def _sample_loop(self):
+        next_sample_time = time.time()
+        while not self._stop_event.is_set():
+            try:
+                temperature = self._oven.read_temperature()
+            except Exception as e:  # pylint: disable=W0703
+                # Serial errors too: waiters re-raise it instead of waiting for a sample that never comes.
+                with self._condition:
+                    self._error = e
+                    self._condition.notify_all()
+                return
+            with self._condition:
+                self._samples.append((time.time(), temperature))
+                self._condition.notify_all()
+            next_sample_time += self.sample_interval
+            self._stop_event.wait(max(0, next_sample_time - time.time()))
+
+    def current_temperature(self, timeout=None):
+        # Latest PV, waits for the first sample if there is none yet.
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while not self._samples:
+                self._raise_error()
+                if self._thread is None:
+                    raise OvenException('Temperature monitor is not running')
+                if deadline is not None and time.time() >= deadline:
+                    raise OvenException('No temperature sample from oven after %d s' % timeout)
+                self._condition.wait(self.sample_interval)
+            return self._samples[-1][1]
+
+    def latest(self):
+        # (timestamp, temperature) of the last sample, None before the first one.
+        with self._condition:
+            self._raise_error()
+            return self._samples[-1] if self._samples else None
+
+    def window_stats(self, duration):
+        # (min, max, mean) of the samples taken in the last duration seconds, None if there are none.
+        with self._condition:
+            self._raise_error()
+            temperatures = self._window(duration)
+        if not temperatures:
+            return None
+        return min(temperatures), max(temperatures), sum(temperatures) / len(temperatures)
+
+    def is_stable(self, target, tolerance=DEFAULT_SOAK_TOLERANCE, stable_time=DEFAULT_SOAK_STABLE_TIME):
+        with self._condition:
+            self._raise_error()
+            return self._is_stable(target, tolerance, stable_time)
+
+    def wait_stable(self, target, tolerance=DEFAULT_SOAK_TOLERANCE, stable_time=DEFAULT_SOAK_STABLE_TIME,
+                    timeout=None):
+        """Block until every sample of the last stable_time seconds is within target +/- tolerance.
+        Returns the seconds waited, raises OvenException on timeout.
+        """
+        start_time = time.time()
+        with self._condition:
+            while not self._is_stable(target, tolerance, stable_time):
+                self._raise_error()
+                if self._thread is None:
+                    raise OvenException('Temperature monitor is not running')
+                remaining = None if timeout is None else start_time + timeout - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise OvenException('Oven did not stabilize at %.1f C +/- %.1f within %d s' %
+                                        (target, tolerance, timeout))
+                # Woken up by every new sample.
+                self._condition.wait(remaining if remaining is not None else self.sample_interval * 2)
+        return time.time() - start_time
+
+    def _window(self, duration):
+        if not self._samples:
+            return []
+        since = self._samples[-1][0] - duration
+        return [temperature for timestamp, temperature in self._samples if timestamp >= since]
+
+    def _is_stable(self, target, tolerance, stable_time):
+        if not self._samples:
+            return False
+        latest_time = self._samples[-1][0]
+        # Walk back from the newest sample: stable once in-band samples cover stable_time.
+        for timestamp, temperature in reversed(self._samples):
+            if abs(temperature - target) > tolerance:
+                return False
+            if latest_time - timestamp >= stable_time:
+                return True
+        return False
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+
+class Ramp(object):
+    # Move the setpoint to target, at rate degrees C per minute (None: jump straight there).
+
+    def __init__(self, target, rate=None):
+        self.target = target
+        self.rate = rate
+
+    def __repr__(self):
+        return 'Ramp(%r, rate=%r)' % (self.target, self.rate)
+
+
+class Soak(object):
+    # Wait until PV is stable at the last ramp's target, then hold it there for duration seconds.
+
+    def __init__(self, duration, tolerance=DEFAULT_SOAK_TOLERANCE, stable_time=DEFAULT_SOAK_STABLE_TIME,
+                 stable_timeout=None):
+        self.duration = duration
+        self.tolerance = tolerance
+        self.stable_time = stable_time
+        self.stable_timeout = stable_timeout
+
+    def __repr__(self):
+        return 'Soak(%r, tolerance=%r, stable_time=%r)' % (self.duration, self.tolerance, self.stable_time)
+
+
+class ProfileRunner(object):
+    """Runs a list of Ramp/Soak segments on an oven.
+
+        profile = [Ramp(85, rate=2), Soak(600), Ramp(-40, rate=2), Soak(600), Ramp(25)]
+        runner = ProfileRunner(oven, profile)
+        runner.start()      # or runner.run() to block
+        ...
+        runner.wait()
+
+    Soaks start counting as soon as the chamber is actually stable, not after a fixed padding time.
+    """
+
+    def __init__(self, oven, segments, sample_interval=DEFAULT_SAMPLE_INTERVAL):
+        self._oven = oven
+        self.segments = list(segments)
+        self.monitor = TemperatureMonitor(oven, sample_interval)
+        self.current_segment = None
+        self.soak_wait_times = []   # seconds each Soak spent waiting for stability
+        self._setpoint = None
+        self._error = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run_in_thread, name="OvenProfileRunner")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def wait(self, timeout=None):
+        # Returns False if the profile is still running after timeout.  Re-raises what stopped the profile.
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            return False
+        if self._error is not None:
+            raise self._error
+        return True
+
+    def stop(self):
+        # Abort after the current sample; the oven stays at the last setpoint.
+        self._stop_event.set()
+        self.monitor.stop()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run_in_thread(self):
+        try:
+            self.run()
+        except Exception as e:  # pylint: disable=W0703
+            # Hand it to whoever calls wait().
+            self._error = e
+
+    def run(self):
+        self.monitor.start()
+        try:
+            for segment in self.segments:
+                if self._stop_event.is_set():
+                    break
+                self.current_segment = segment
+                if isinstance(segment, Ramp):
+                    self._ramp(segment)
+                elif isinstance(segment, Soak):
+                    self._soak(segment)
+                else:
+                    raise OvenException('Unknown profile segment: %r' % (segment,))
+        finally:
+            self.current_segment = None
+            self.monitor.stop()
+
+    def _ramp(self, ramp):
+        if ramp.rate is None:
+            self._set_setpoint(ramp.target)
+            return
+        start = self._setpoint
+        if start is None:
+            start = self.monitor.current_temperature()
+        step_time = self.monitor.sample_interval
+        duration = abs(ramp.target - start) / ramp.rate * 60.0
+        start_time = time.time()
+        while not self._stop_event.is_set():
+            elapsed = time.time() - start_time
+            if elapsed >= duration:
+                break
+            self._set_setpoint(start + (ramp.target - start) * elapsed / duration)
+            self._stop_event.wait(step_time)
+        self._set_setpoint(ramp.target)
+
+    def _soak(self, soak):
+        if self._setpoint is None:
+            raise OvenException('Soak needs a Ramp before it to set the temperature')
+        try:
+            self.soak_wait_times.append(self.monitor.wait_stable(self._setpoint, soak.tolerance, soak.stable_time,
+                                                                 soak.stable_timeout))
+        except OvenException:
+            if self._stop_event.is_set():
+                # stop() shut the monitor down under us.
+                return
+            raise
+        self._stop_event.wait(soak.duration)
+
+    def _set_setpoint(self, temperature):
+        self._oven.set_temperature(temperature)
+        self._setpoint = temperature
 
 
 def _print_usage():
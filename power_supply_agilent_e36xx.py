@@ -72,6 +72,11 @@ class AgilentE36xxPowerSupply(visa_instrument.VisaInstrument):
     # [based on e3646, e3640, e3633]
     # Some model-to-model variation in more-advanced functions.
 
+    # Settings that don't need to be re-sent if they haven't changed (see VisaInstrument shadow state cache).
+    # OUTP is left out on purpose: over-voltage/current protection can turn the output off on its own.
+    _STATE_CACHE_HEADERS = ("VOLT", "CURR", "SOUR:VOLT:RANG", "DISP:STAT")
+    _STATE_SCOPE_HEADERS = ("INST:SEL",)
+
     def __init__(self, resourceName, model='e3640a', do_selftest=True):
         if model.lower() not in MODEL_DEFINITIONS:
             raise PowerSupplyError("Unsupported model [{0}]".format(model))
@@ -130,8 +135,9 @@ class AgilentE36xxPowerSupply(visa_instrument.VisaInstrument):
     def configure_and_enable_output(self, voltage, current_limit=None, channel=1):
         '''Equivalent to OutputOnAt#v#.txt and Agilent3646_ChX_OutputOnAt#V#.txt
         '''
-        self.select_output_channel(channel)
-        self.set_current_limit(current_limit)
-        self.set_voltage(voltage)
-        self.output_on()
+        with self.batch():
+            self.select_output_channel(channel)
+            self.set_current_limit(current_limit)
+            self.set_voltage(voltage)
+            self.output_on()
         return self.measure_voltage()
@@ -37,3 +37,8 @@ try:
 except ImportError:
     from .check_output import check_output
 
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
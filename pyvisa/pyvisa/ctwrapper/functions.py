@@ -35,7 +35,7 @@ visa_functions = [
     "open_default_resource_manager", "out_16", "out_32", "out_8",
     "parse_resource", "parse_resource_extended", "peek_16", "peek_32",
     "peek_8", "poke_16", "poke_32", "poke_8", "printf", "queryf", "read",
-    "read_asynchronously", "read_to_file", "read_stb", "scanf",
+    "read_asynchronously", "read_into", "read_to_file", "read_stb", "scanf",
     "set_attribute", "set_buffer", "sprintf", "sscanf", "status_description",
     "terminate", "uninstall_handler", "unlock", "unmap_address",
     "unmap_trigger", "usb_control_in", "usb_control_out", "vprintf", "vqueryf",
@@ -1380,6 +1380,23 @@ def read(library, session, count):
     return buffer.raw[:return_count.value]
 
 
+def read_into(library, session, buffer, offset, count):
+    """Reads data from device or interface synchronously into an existing buffer.
+
+    :param library: the visa library wrapped by ctypes.
+    :param session: Unique logical identifier to a session.
+    :param buffer: writable buffer (e.g. a bytearray) that receives the data.
+    :param offset: position in buffer where the data is stored.
+    :param count: Number of bytes to be read.
+    :return: number of bytes read.
+    :rtype: int
+    """
+    target = (ViChar * count).from_buffer(buffer, offset)
+    return_count = ViUInt32()
+    library.viRead(session, target, count, byref(return_count))
+    return return_count.value
+
+
 def read_asynchronously(library, session, count):
     """Reads data from device or interface asynchronously.
 
@@ -22,7 +22,7 @@ from .constants import *
 from . import ctwrapper
 from . import errors
 from .util import (warning_context, split_kwargs, warn_for_invalid_kwargs,
-                   parse_ascii, parse_binary, get_library_paths)
+                   parse_ascii, parse_binary, binary_block_size, get_library_paths)
 
 
 def add_visa_methods(wrapper_module):
@@ -624,20 +624,59 @@ class Instrument(_BaseInstrument):
         :rtype: bytes
 
         """
-        ret = bytes()
+        buffer = bytearray(self.chunk_size)
+        count = self.read_into(buffer)
+        del buffer[count:]
+        return bytes(buffer)
+
+    def read_into(self, buffer, offset=0):
+        """Read a message from the device into buffer, starting at offset.
+
+        The data is stored in place, so a buffer can be reused across reads.
+        A bytearray is grown when the message does not fit; any other writable
+        buffer has to be large enough already.
+
+        If the message starts with a definite length binary block header
+        (#<n><length>), the buffer is sized from the header at once and
+        reading goes on until the whole block has arrived, even if a
+        termination character shows up inside the binary data.
+
+        :param buffer: writable buffer, preferably a bytearray.
+        :param offset: position in buffer at which to store the message.
+        :return: number of bytes read.
+        :rtype: int
+        """
+        end = offset
+        expected_end = None
+        status = VI_SUCCESS_MAX_CNT
+        logger.debug('Reading from session %s into buffer of %d bytes',
+                     self.session, len(buffer))
         with warning_context("ignore", "VI_SUCCESS_MAX_CNT"):
             try:
-                status = VI_SUCCESS_MAX_CNT
-                while status == VI_SUCCESS_MAX_CNT:
-                    logger.debug('Reading %d bytes from session %s (last status %r)',
-                                 self.chunk_size, self.session, status)
-                    ret += self.visalib.read(self.session, self.chunk_size)
+                while status == VI_SUCCESS_MAX_CNT or (expected_end is not None and end < expected_end):
+                    wanted = self.chunk_size
+                    if expected_end is not None and expected_end > end:
+                        wanted = max(wanted, expected_end - end)
+                    if len(buffer) - end < wanted:
+                        if not isinstance(buffer, bytearray):
+                            if len(buffer) == end:
+                                raise ValueError("buffer too small for message")
+                            wanted = len(buffer) - end
+                        else:
+                            buffer.extend(bytearray(max(wanted, len(buffer)) - (len(buffer) - end)))
+
+                    end += self.visalib.read_into(self.session, buffer, end, wanted)
                     status = self.visalib.status
+
+                    if expected_end is None and end > offset:
+                        block_size = binary_block_size(bytes(buffer[offset:offset + 12]))
+                        if block_size is not None:
+                            expected_end = offset + block_size
             except errors.VisaIOError as e:
                 logger.debug('Exception while reading: %s', e)
                 raise
 
-        return ret
+        return end - offset
 
     def read(self, termination=None):
         """Read a string from the device.
@@ -670,13 +709,15 @@ class Instrument(_BaseInstrument):
 
         return message[:-len(termination)]
 
-    def read_values(self, fmt=None):
+    def read_values(self, fmt=None, container=list):
         """Read a list of floating point values from the device.
 
         :param fmt: the format of the values.  If given, it overrides
             the class attribute "values_format".  Possible values are bitwise
             disjunctions of the above constants ascii, single, double, and
             big_endian.  Default is ascii.
+        :param container: type of the result, e.g. numpy.ndarray to parse
+            the values straight into an array.
 
         :return: the list of read values
         :rtype: list
@@ -685,7 +726,7 @@ class Instrument(_BaseInstrument):
             fmt = self.values_format
 
         if fmt & 0x01 == ascii:
-            return parse_ascii(self.read())
+            return parse_ascii(self.read(), container)
 
         data = self.read_raw()
 
@@ -696,7 +737,7 @@ class Instrument(_BaseInstrument):
                 is_single = False
             else:
                 raise ValueError("unknown data values fmt requested")
-            return parse_binary(data, fmt & 0x04 == big_endian, is_single)
+            return parse_binary(data, fmt & 0x04 == big_endian, is_single, container)
         except ValueError as e:
             raise errors.InvalidBinaryFormat(e.args)
 
@@ -718,13 +759,14 @@ class Instrument(_BaseInstrument):
             time.sleep(delay)
         return self.read()
 
-    def ask_for_values(self, message, format=None, delay=None):
+    def ask_for_values(self, message, format=None, delay=None, container=list):
         """A combination of write(message) and read_values()
 
         :param message: the message to send.
         :type message: str
         :param delay: delay in seconds between write and read operations.
                       if None, defaults to self.ask_delay
+        :param container: type of the result, see read_values.
         :returns: the answer from the device.
         :rtype: list
         """
@@ -734,7 +776,7 @@ class Instrument(_BaseInstrument):
             delay = self.ask_delay
         if delay > 0.0:
             time.sleep(delay)
-        return self.read_values(format)
+        return self.read_values(format, container)
 
     def trigger(self):
         """Sends a software trigger to the device.
@@ -1017,13 +1059,23 @@ def get_instruments_list(use_aliases=True):
     :return: A list of strings with the names of all connected devices,
              ready for being used to open each of them.
 
+    When the station's visa_discovery module is importable, the resource names
+    come from its cached scan (refreshed in the background once it is older
+    than visa_discovery.DISCOVERY_TTL) instead of a new viFindRsrc walk.
+
     """
+    resource_manager = get_resource_manager()
+    try:
+        from visa_discovery import list_resources
+    except ImportError:
+        list_resources = resource_manager.list_resources
+    resources = list_resources()
 
     if use_aliases:
-        return [info.alias or resource_name
-                for resource_name, info in get_resource_manager().list_resources_info().items()]
+        return [resource_manager.resource_info(resource_name).alias or resource_name
+                for resource_name in resources]
 
-    return get_resource_manager().list_resources()
+    return resources
 
 
 def instrument(resource_name, **kwargs):
@@ -13,13 +13,14 @@
 
 from __future__ import division, unicode_literals, print_function, absolute_import
 
+import array
 import io
 import os
 import re
 import sys
 import struct
 import subprocess
-from .compat import check_output
+from .compat import check_output, np
 import contextlib
 import platform
 import warnings
@@ -190,13 +191,34 @@ def warning_context(action, message="", category=Warning, module="", lineno=0, a
 _ascii_re = re.compile(r"[-+]?(?:\d+(?:\.\d*)?|\d*\.\d+)(?:[eE][-+]?\d+)?")
 
 
-def parse_ascii(bytes_data):
-    return [float(raw_value) for raw_value in
-            _ascii_re.findall(bytes_data.decode('ascii'))]
+def _is_numpy_container(container):
+    return np is not None and container is np.ndarray
 
 
-def parse_binary(bytes_data, is_big_endian=False, is_single=False):
+def parse_ascii(bytes_data, container=list):
+    """Parse comma separated ascii values.
 
+    :param container: type of the result. list (default) uses a regex and
+                      is lenient about separators and units; numpy.ndarray
+                      uses numpy.fromstring and expects plain comma separated
+                      numbers. Any other type is built from the list.
+    """
+    if _is_numpy_container(container):
+        return np.fromstring(bytes_data.decode('ascii'), dtype=np.float64, sep=',')
+
+    result = [float(raw_value) for raw_value in
+              _ascii_re.findall(bytes_data.decode('ascii'))]
+    if container is not list:
+        result = container(result)
+    return result
+
+
+def _strip_binary_block_header(bytes_data):
+    """Return the data part of an IEEE-488.2 binary block.
+
+    Both definite length (#<n><length><data>) and indefinite length
+    (#0<data>\\n) blocks are accepted.
+    """
     data = bytes_data
 
     hash_sign_position = bytes_data.find(b"#")
@@ -221,6 +243,44 @@ def parse_binary(bytes_data, is_big_endian=False, is_single=False):
     else:
         raise ValueError()
 
+    return data, data_length
+
+
+def binary_block_size(bytes_data):
+    """Return the total size (header + data) of the definite length binary
+    block at the start of bytes_data, or None if it does not start with one
+    or the header is incomplete.
+    """
+    if bytes_data[0:1] != b"#":
+        return None
+
+    number_of_digits = bytes_data[1:2]
+    if not number_of_digits.isdigit() or number_of_digits == b"0":
+        return None
+
+    header_length = 2 + int(number_of_digits)
+    data_length = bytes_data[2:header_length]
+    if len(data_length) < header_length - 2 or not data_length.isdigit():
+        return None
+
+    return header_length + int(data_length)
+
+
+def parse_binary(bytes_data, is_big_endian=False, is_single=False, container=list):
+    """Parse an IEEE-488.2 binary block of single or double floats.
+
+    :param container: type of the result. numpy.ndarray returns a read-only
+                      view on the data (numpy.frombuffer), any other type
+                      is built from the list.
+    """
+    data, data_length = _strip_binary_block_header(bytes_data)
+
+    if _is_numpy_container(container):
+        dtype = np.dtype(str('f4') if is_single else str('f8')).newbyteorder(str('>') if is_big_endian else str('<'))
+        if len(data) != data_length or data_length % dtype.itemsize:
+            raise ValueError("Binary data itself was malformed")
+        return np.frombuffer(data, dtype=dtype)
+
     if is_big_endian:
         endianess = ">"
     else:
@@ -236,6 +296,32 @@ def parse_binary(bytes_data, is_big_endian=False, is_single=False):
     except struct.error:
         raise ValueError("Binary data itself was malformed")
 
+    if container is not list:
+        result = container(result)
+    return result
+
+
+def parse_binary_array(bytes_data, is_big_endian=False, is_single=False):
+    """Like parse_binary, but return an array.array ('f' or 'd').
+
+    The data is copied straight into the array, so no Python float object is
+    created per value.  Handy for large (logging) buffers.
+    """
+
+    data, data_length = _strip_binary_block_header(bytes_data)
+
+    result = array.array(str('f') if is_single else str('d'))
+    if len(data) != data_length or data_length % result.itemsize:
+        raise ValueError("Binary data itself was malformed")
+
+    if sys.version >= '3':
+        result.frombytes(data)
+    else:
+        result.fromstring(data)
+
+    if is_big_endian != (sys.byteorder == 'big'):
+        result.byteswap()
+
     return result
 
 
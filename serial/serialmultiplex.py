@@ -0,0 +1,167 @@
+#! python
+#
+# Python Serial Port Extension for Win32, Linux, BSD, Jython
+# see __init__.py
+#
+# This module implements a select based multiplexer that lets a single thread
+# talk to many POSIX serial ports at once, instead of one thread per port that
+# sits blocked in read().
+#
+# Usage:
+#   mux = PortMultiplexer()
+#   for port in ports:
+#       mux.add(port)
+#   replies = mux.transact_all(dict((port, 'RS\r') for port in ports), eol='\r', timeout=1)
+#
+# this is distributed under a free software license, see license.txt
+
+import os
+import select
+import time
+
+from serialutil import *
+
+
+class PortMultiplexer(object):
+    """Drive several open serial ports from one thread.
+
+    Each port gets its own receive buffer.  poll() waits on all of them in a
+    single select() call and moves whatever arrived into those buffers, the
+    read functions then serve from the buffers.  Data a port's own readline
+    already read ahead is moved over first.  Needs ports backed by a real
+    file descriptor (PosixSerial); socket:// and rfc2217:// ports are not
+    supported.
+    """
+
+    READ_CHUNK_SIZE = 4096
+
+    def __init__(self):
+        self._buffers = {}      # port -> bytearray with received, not yet consumed data
+
+    def add(self, port):
+        """Start multiplexing an open port."""
+        if not port.isOpen():
+            raise portNotOpenError
+        self._buffers.setdefault(port, bytearray())
+        self._drain_port_buffers([port])
+
+    def remove(self, port):
+        """Stop multiplexing port. Data still buffered for it is returned."""
+        return bytes(self._buffers.pop(port))
+
+    def ports(self):
+        return list(self._buffers.keys())
+
+    def in_waiting(self, port):
+        """Number of bytes already buffered for port."""
+        self._drain_port_buffers([port])
+        return len(self._buffers[port])
+
+    def poll(self, timeout=0, ports=None):
+        """Wait up to timeout seconds (None: forever) for data on any of the
+        given ports (default: all) and buffer it. Returns the list of ports
+        that received data."""
+        if ports is None:
+            ports = self.ports()
+        if not ports:
+            return []
+        # select() can't see what readline already pulled out of the fd.
+        drained = self._drain_port_buffers(ports)
+        ready, _, _ = select.select(ports, [], [], 0 if drained else timeout)
+        for port in ready:
+            # the fd is opened O_NONBLOCK, so this returns what is there.
+            data = os.read(port.fileno(), self.READ_CHUNK_SIZE)
+            if not data:
+                # see PosixSerial.read: ready but no data means the device is gone.
+                raise SerialException('device reports readiness to read but returned no data (device disconnected?)')
+            self._buffers[port].extend(data)
+        return drained + [port for port in ready if port not in drained]
+
+    def write(self, port, data):
+        return port.write(data)
+
+    def read(self, port, size=1, timeout=None):
+        """Read up to size bytes from port, waiting at most timeout seconds
+        (None: forever) for them to arrive."""
+        deadline = _deadline(timeout)
+        self._drain_port_buffers([port])
+        buf = self._buffers[port]
+        while len(buf) < size:
+            remaining = _remaining(deadline)
+            if remaining == 0:
+                break
+            self.poll(remaining, [port])
+        return self._take(port, min(size, len(buf)))
+
+    def read_until(self, port, eol=LF, timeout=None):
+        """Read from port up to and including eol. On timeout whatever was
+        received so far is returned (without eol)."""
+        return self.read_until_all({port: eol}, timeout)[port]
+
+    def read_until_all(self, requests, timeout=None):
+        """Wait for a reply on several ports at once.
+
+        requests maps port -> eol. Returns a dict port -> data, data ends with
+        eol unless that port timed out. All ports share the same timeout.
+        """
+        deadline = _deadline(timeout)
+        replies = {}
+        pending = dict(requests)
+        self._drain_port_buffers(list(pending.keys()))
+        while True:
+            for port, eol in list(pending.items()):
+                index = self._buffers[port].find(eol)
+                if index >= 0:
+                    replies[port] = self._take(port, index + len(eol))
+                    del pending[port]
+            remaining = _remaining(deadline)
+            if not pending or remaining == 0:
+                break
+            self.poll(remaining, list(pending.keys()))
+
+        for port in pending:
+            replies[port] = self._take(port, len(self._buffers[port]))
+        return replies
+
+    def transact_all(self, commands, eol=LF, timeout=None):
+        """Write a command to each port and collect all replies.
+
+        commands maps port -> data to send. Ports are written back to back
+        and then waited on together, so N devices cost about one device's
+        round trip instead of N.
+        """
+        for port, data in commands.items():
+            self.write(port, data)
+        return self.read_until_all(dict((port, eol) for port in commands), timeout)
+
+    def _drain_port_buffers(self, ports):
+        """Move data left in the ports' own receive buffers (see
+        FileLike.readline) into ours. Returns the ports that had some."""
+        drained = []
+        for port in ports:
+            take_read_buffer = getattr(port, '_take_read_buffer', None)
+            if take_read_buffer is None:
+                continue
+            data = take_read_buffer()
+            if data:
+                self._buffers[port].extend(data)
+                drained.append(port)
+        return drained
+
+    def _take(self, port, count):
+        buf = self._buffers[port]
+        data = bytes(buf[:count])
+        del buf[:count]
+        return data
+
+
+def _deadline(timeout):
+    if timeout is None:
+        return None
+    return time.time() + timeout
+
+
+def _remaining(deadline):
+    if deadline is None:
+        return None
+    return max(0, deadline - time.time())
@@ -270,6 +270,8 @@ class PosixSerial(SerialBase):
         if self._isOpen:
             raise SerialException("Port is already open.")
         self.fd = None
+        # data received by readline after the end of the line, served by read() first
+        self._read_buffer = bytearray()
         # open
         try:
             self.fd = os.open(self.portstr, os.O_RDWR|os.O_NOCTTY|os.O_NONBLOCK)
@@ -433,7 +435,7 @@ class PosixSerial(SerialBase):
         """Return the number of characters currently in the input buffer."""
         #~ s = fcntl.ioctl(self.fd, TERMIOS.FIONREAD, TIOCM_zero_str)
         s = fcntl.ioctl(self.fd, TIOCINQ, TIOCM_zero_str)
-        return struct.unpack('I',s)[0]
+        return struct.unpack('I',s)[0] + len(self._read_buffer)
 
     # select based implementation, proved to work on many systems
     def read(self, size=1):
@@ -441,7 +443,7 @@ class PosixSerial(SerialBase):
            return less characters as requested. With no timeout it will block
            until the requested number of bytes is read."""
         if not self._isOpen: raise portNotOpenError
-        read = bytearray()
+        read = self._read_from_buffer(size)
         while len(read) < size:
             ready,_,_ = select.select([self.fd],[],[], self._timeout)
             # If select was used with a timeout, and the timeout occurs, it
@@ -461,6 +463,17 @@ class PosixSerial(SerialBase):
             read.extend(buf)
         return bytes(read)
 
+    def _read_from_buffer(self, size):
+        """Take up to size bytes left over by readline."""
+        read = self._read_buffer[:size]
+        del self._read_buffer[:size]
+        return read
+
+    def _read_chunk(self):
+        """readline helper: wait for one byte, but take everything that is
+        already waiting in one go instead of a select/read per byte."""
+        return self.read(max(1, self.inWaiting()))
+
     def write(self, data):
         """Output the given string over the serial port."""
         if not self._isOpen: raise portNotOpenError
@@ -497,6 +510,7 @@ class PosixSerial(SerialBase):
     def flushInput(self):
         """Clear input buffer, discarding all that is in the buffer."""
         if not self._isOpen: raise portNotOpenError
+        del self._read_buffer[:]
         termios.tcflush(self.fd, TERMIOS.TCIFLUSH)
 
     def flushOutput(self):
@@ -598,7 +612,11 @@ except ImportError:
 else:
     # io library present
     class Serial(PosixSerial, io.RawIOBase):
-        pass
+        # io's readline reads byte by byte, use the buffered one from FileLike instead.
+        readline = FileLike.__dict__['readline']
+        readlines = FileLike.__dict__['readlines']
+        xreadlines = FileLike.__dict__['xreadlines']
+        _take_read_buffer = FileLike.__dict__['_take_read_buffer']
 
 class PosixPollSerial(Serial):
     """poll based read implementation. not all systems support poll properly.
@@ -610,7 +628,7 @@ class PosixPollSerial(Serial):
            return less characters as requested. With no timeout it will block
            until the requested number of bytes is read."""
         if self.fd is None: raise portNotOpenError
-        read = bytearray()
+        read = self._read_from_buffer(size)
         poll = select.poll()
         poll.register(self.fd, select.POLLIN|select.POLLERR|select.POLLHUP|select.POLLNVAL)
         if size > 0:
@@ -142,18 +142,43 @@ class FileLike(object):
         """read a line which is terminated with end-of-line (eol) character
         ('\n' by default) or until timeout."""
         leneol = len(eol)
-        line = bytearray()
+        line = self._take_read_buffer()
+        searched = 0
         while True:
-            c = self.read(1)
+            index = line.find(eol, searched)
+            if index >= 0:
+                end = index + leneol
+                break
+            if size is not None and len(line) >= size:
+                end = size
+                break
+            # eol may straddle the old and the new data
+            searched = max(0, len(line) - leneol + 1)
+            c = self._read_chunk()
             if c:
                 line += c
-                if line[-leneol:] == eol:
-                    break
-                if size is not None and len(line) >= size:
-                    break
             else:
+                end = len(line)
                 break
-        return bytes(line)
+        if size is not None:
+            end = min(end, size)
+        # whatever came in after the line is served by the next read
+        self._read_buffer = line[end:]
+        return bytes(line[:end])
+
+    def _take_read_buffer(self):
+        """hand out (and empty) the receive buffer used by readline"""
+        buf = getattr(self, '_read_buffer', None)
+        self._read_buffer = bytearray()
+        if buf is None:
+            return bytearray()
+        return buf
+
+    def _read_chunk(self):
+        """return the next data for readline, empty on timeout. Reads one
+        byte at a time, so nothing is ever read past the line end. Ports
+        whose read() serves _read_buffer first can read larger chunks."""
+        return self.read(1)
 
     def readlines(self, sizehint=None, eol=LF):
         """read a list of lines, until timeout.
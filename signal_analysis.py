@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+'''Square wave analysis for NI DAQ captures: edges, frequency, duty cycle, period jitter, rise/fall times.
+
+Everything takes a sequence of voltages sampled at a fixed rate.  With numpy installed the work is vectorized
+and numpy arrays (including read-only memory maps of binary captures, see map_binary_capture) are analyzed
+without copying; without numpy the same results come from a single Python loop over any sequence.
+
+Edges are found with two thresholds (hysteresis): the signal is high once it reaches high_threshold and stays
+high until it drops to low_threshold, so noise around a single threshold doesn't count as extra edges.
+
+    samples = signal_analysis.map_binary_capture('capture.f64')
+    rising, falling = signal_analysis.find_edges(samples, 1.0, 3.5)
+    print signal_analysis.frequency(samples, 250000, 1.0, 3.5)
+'''
+
+import array
+import math
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class SignalAnalysisException(Exception):
+    pass
+
+
+def load_csv_capture(path, column=1):
+    '''Voltages from an NI DAQ CSV capture (one header row, then "time, voltage" rows).'''
+    with open(path, "rb") as csvfile:
+        header = csvfile.readline()
+        text = csvfile.read().strip()
+    num_columns = header.count(",") + 1
+    if np is not None:
+        if not text:
+            return np.zeros(0)
+        return np.fromstring(text.replace("\n", ","), sep=",")[column::num_columns]
+    return array.array('d', (float(line.split(",")[column]) for line in text.splitlines() if line.strip()))
+
+
+def map_binary_capture(path, dtype='<f8'):
+    '''Voltages from a raw binary capture (little endian float64 by default).  With numpy the file is memory
+    mapped read-only, so only the pages the analysis touches are read.
+    '''
+    if np is not None:
+        return np.memmap(path, dtype=dtype, mode='r')
+    if dtype != '<f8':
+        raise SignalAnalysisException("Only '<f8' captures can be read without numpy")
+    samples = array.array('d')
+    with open(path, "rb") as capture:
+        samples.fromstring(capture.read())
+    if sys.byteorder != 'little':
+        samples.byteswap()
+    return samples
+
+
+def summary(samples):
+    '''(min, max, mean) of the samples.'''
+    if len(samples) == 0:
+        raise SignalAnalysisException("No samples")
+    if np is not None:
+        samples = np.asarray(samples)
+        return float(samples.min()), float(samples.max()), float(samples.mean())
+    minimum = maximum = samples[0]
+    total = 0.0
+    for value in samples:
+        if value < minimum:
+            minimum = value
+        elif value > maximum:
+            maximum = value
+        total += value
+    return minimum, maximum, total / len(samples)
+
+
+def fraction_above(samples, threshold):
+    '''Fraction of the samples above threshold.'''
+    if len(samples) == 0:
+        raise SignalAnalysisException("No samples")
+    if np is not None:
+        return np.count_nonzero(np.asarray(samples) > threshold) / float(len(samples))
+    return sum(1 for value in samples if value > threshold) / float(len(samples))
+
+
+def _hysteresis(samples, low_threshold, high_threshold):
+    # Returns (rising, falling, rise_lengths, fall_lengths).  rising/falling are the indexes of the first sample
+    # at/above high_threshold resp. at/below low_threshold after a transition.  The lengths count the samples
+    # since the signal last was on the other side, i.e. how long the transition through the band took.
+    if low_threshold > high_threshold:
+        raise SignalAnalysisException("low_threshold must not be above high_threshold")
+    if np is not None:
+        samples = np.asarray(samples)
+        if len(samples) == 0:
+            empty = np.zeros(0, dtype=np.intp)
+            return empty, empty, empty, empty
+        high = samples >= high_threshold
+        determined = high | (samples <= low_threshold)
+        if not determined.any():
+            empty = np.zeros(0, dtype=np.intp)
+            return empty, empty, empty, empty
+        # Index of the last sample outside the band, at or before each sample; the band inherits its state.
+        last_determined = np.where(determined, np.arange(len(samples)), 0)
+        first = int(np.argmax(determined))
+        last_determined[:first] = first
+        np.maximum.accumulate(last_determined, out=last_determined)
+        state = high[last_determined].astype(np.int8)
+        change = np.flatnonzero(np.diff(state)) + 1
+        rising = change[state[change] == 1]
+        falling = change[state[change] == 0]
+        return (rising, falling,
+                rising - last_determined[rising - 1], falling - last_determined[falling - 1])
+
+    rising, falling, rise_lengths, fall_lengths = [], [], [], []
+    state = None
+    last_determined = None
+    for index, value in enumerate(samples):
+        if value >= high_threshold:
+            if state is False:
+                rising.append(index)
+                rise_lengths.append(index - last_determined)
+            state = True
+        elif value <= low_threshold:
+            if state is True:
+                falling.append(index)
+                fall_lengths.append(index - last_determined)
+            state = False
+        else:
+            continue
+        last_determined = index
+    return rising, falling, rise_lengths, fall_lengths
+
+
+def find_edges(samples, low_threshold, high_threshold):
+    '''Sample indexes of the (rising, falling) edges.'''
+    rising, falling, _, _ = _hysteresis(samples, low_threshold, high_threshold)
+    return rising, falling
+
+
+def periods(samples, sample_rate, low_threshold, high_threshold):
+    '''Seconds between consecutive rising edges.'''
+    rising = find_edges(samples, low_threshold, high_threshold)[0]
+    if np is not None:
+        return np.diff(rising) / float(sample_rate)
+    return [(b - a) / float(sample_rate) for a, b in zip(rising[:-1], rising[1:])]
+
+
+def frequency(samples, sample_rate, low_threshold, high_threshold):
+    '''Frequency in Hz over the whole periods in the capture, 0 if there are fewer than two rising edges.'''
+    rising = find_edges(samples, low_threshold, high_threshold)[0]
+    if len(rising) < 2:
+        return 0.0
+    return (len(rising) - 1) * float(sample_rate) / (rising[-1] - rising[0])
+
+
+def duty_cycle(samples, low_threshold, high_threshold):
+    '''Fraction of each period the signal is high, over the whole periods in the capture.'''
+    rising, falling = find_edges(samples, low_threshold, high_threshold)
+    if len(rising) < 2:
+        raise SignalAnalysisException("Fewer than two rising edges, no whole period to measure")
+    first, last = rising[0], rising[-1]
+    if np is not None:
+        falling = falling[(falling > first) & (falling <= last)]
+        high_samples = np.sum(falling - rising[:len(falling)])
+    else:
+        falling = [index for index in falling if first < index <= last]
+        high_samples = sum(f - r for r, f in zip(rising, falling))
+    return float(high_samples) / (last - first)
+
+
+def period_jitter(samples, sample_rate, low_threshold, high_threshold):
+    '''(mean, standard deviation, peak to peak) of the periods, in seconds.'''
+    period_list = periods(samples, sample_rate, low_threshold, high_threshold)
+    if len(period_list) == 0:
+        raise SignalAnalysisException("Fewer than two rising edges, no period to measure")
+    if np is not None:
+        return float(period_list.mean()), float(period_list.std()), float(period_list.ptp())
+    mean = sum(period_list) / len(period_list)
+    std = math.sqrt(sum((period - mean) ** 2 for period in period_list) / len(period_list))
+    return mean, std, max(period_list) - min(period_list)
+
+
+def rise_fall_times(samples, sample_rate, low_level=None, high_level=None, fraction=(0.1, 0.9)):
+    '''Mean (rise time, fall time) in seconds between the fraction[0] and fraction[1] points of the swing from
+    low_level to high_level (default: the capture's min and max).  None for a direction without edges.
+    Resolution is one sample period.
+    '''
+    if low_level is None or high_level is None:
+        minimum, maximum, _ = summary(samples)
+        low_level = minimum if low_level is None else low_level
+        high_level = maximum if high_level is None else high_level
+    swing = high_level - low_level
+    _, _, rise_lengths, fall_lengths = _hysteresis(samples, low_level + fraction[0] * swing,
+                                                   low_level + fraction[1] * swing)
+    times = []
+    for lengths in (rise_lengths, fall_lengths):
+        if len(lengths) == 0:
+            times.append(None)
+        else:
+            times.append(float(sum(lengths)) / len(lengths) / sample_rate)
+    return tuple(times)
@@ -0,0 +1,67 @@
+import argparse
+import os
+import timeit
+
+import crc16
+
+# Benchmark for crc16: the old one-byte-per-iteration loop vs crc16.calculate (slice-by-8, or crcmod when
+# installed) vs crc16.Crc16 fed in 64 KB blocks.  Run as a module from the repo root:
+#     python -m tests.bench_crc16 --sizes 1024 1048576 104857600
+
+STREAM_BLOCK_SIZE = 65536
+
+
+def legacy_calculate_string(input_string, accumulated_crc_value=crc16.INITIAL_MODBUS):
+    # crc16.calculate_string as it was before calculate() existed.
+    for input_char in input_string:
+        accumulated_crc_value = \
+            (accumulated_crc_value >> 8) ^ crc16.POLYNOMIAL_TABLE[(accumulated_crc_value ^ ord(input_char)) & 0xFF]
+    return accumulated_crc_value
+
+
+def streamed_calculate(data):
+    crc = crc16.Crc16()
+    view = memoryview(data)
+    for start in xrange(0, len(data), STREAM_BLOCK_SIZE):
+        crc.update(view[start:start + STREAM_BLOCK_SIZE])
+    return crc.value
+
+
+def time_call(function, repeat):
+    # best-of to take scheduling noise out of it.
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark crc16 implementations")
+    parser.add_argument('--sizes', '-s',
+                        nargs='+',
+                        default=[1024, 1024 * 1024, 10 * 1024 * 1024],
+                        type=int,
+                        help="Payload sizes in bytes")
+    parser.add_argument('--repeat', '-r',
+                        default=3,
+                        type=int,
+                        help="Number of timing runs per case (best is reported)")
+    args = parser.parse_args()
+
+    if crc16._crcmod_modbus is not None:  # pylint: disable=W0212
+        print "crcmod installed, calculate() uses its C extension."
+
+    print "{0:>10} {1:>12} {2:>12} {3:>12} {4:>8}".format("bytes", "legacy (s)", "calculate (s)", "Crc16 (s)",
+                                                          "speedup")
+    for size in args.sizes:
+        data = os.urandom(size)
+        expected = legacy_calculate_string(data)
+        if crc16.calculate(data) != expected or streamed_calculate(data) != expected:
+            raise AssertionError("CRC mismatch for {0} bytes".format(size))
+
+        legacy_time = time_call(lambda: legacy_calculate_string(data), args.repeat)
+        calculate_time = time_call(lambda: crc16.calculate(data), args.repeat)
+        stream_time = time_call(lambda: streamed_calculate(data), args.repeat)
+        print "{0:>10} {1:>12.6f} {2:>12.6f} {3:>12.6f} {4:>7.1f}x".format(size, legacy_time, calculate_time,
+                                                                          stream_time, legacy_time / calculate_time)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+import argparse
+import struct
+import timeit
+
+import pyvisa.pyvisa.util as visa_util
+from pyvisa.pyvisa.compat import np
+
+# Micro-benchmark for pyvisa's value parsers: list (regex/struct) vs numpy.ndarray (fromstring/frombuffer).
+# No instrument needed.  Run as a module from the repo root:
+#     python -m tests.bench_pyvisa_parse
+
+
+def make_ascii_payload(num_values):
+    return ','.join('{0:+.9E}'.format(i * 0.001) for i in range(num_values)).encode('ascii') + b'\n'
+
+
+def make_binary_payload(num_values):
+    data = struct.pack('>{0}d'.format(num_values), *[i * 0.001 for i in range(num_values)])
+    data_length = str(len(data))
+    return ('#{0}{1}'.format(len(data_length), data_length)).encode('ascii') + data + b'\n'
+
+
+def time_call(function, repeat):
+    # best-of to take scheduling noise out of it.
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark pyvisa parse_ascii/parse_binary containers")
+    parser.add_argument('--sizes', '-s',
+                        nargs='+',
+                        default=[1000, 100000, 1000000],
+                        type=int,
+                        help="Number of values per payload")
+    parser.add_argument('--repeat', '-r',
+                        default=3,
+                        type=int,
+                        help="Number of timing runs per case (best is reported)")
+    args = parser.parse_args()
+
+    if np is None:
+        print "numpy not installed, only timing the list path."
+
+    print "{0:>10} {1:>8} {2:>12} {3:>12} {4:>8}".format("values", "format", "list (s)", "ndarray (s)", "speedup")
+    for num_values in args.sizes:
+        ascii_payload = make_ascii_payload(num_values)
+        binary_payload = make_binary_payload(num_values)
+        cases = (("ascii", lambda container: visa_util.parse_ascii(ascii_payload, container)),
+                 ("REAL,64", lambda container: visa_util.parse_binary(binary_payload, True, False, container)))
+        for name, parse in cases:
+            list_time = time_call(lambda: parse(list), args.repeat)
+            if np is None:
+                print "{0:>10} {1:>8} {2:>12.6f} {3:>12} {4:>8}".format(num_values, name, list_time, "-", "-")
+                continue
+            array_time = time_call(lambda: parse(np.ndarray), args.repeat)
+            print "{0:>10} {1:>8} {2:>12.6f} {3:>12.6f} {4:>7.1f}x".format(num_values, name, list_time, array_time,
+                                                                           list_time / array_time)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+'''Stand-in for the NI DAQ utilities' --serve mode (see ni_helper.py), for running the drivers without
+hardware.  DIO ports are kept in memory, the frequency counter reads FAKE_FREQ_HZ and acquisitions produce a
+square wave, as a recordSwipe CSV file or streamed back.
+
+    python tests/fake_ni_helper.py [-d Dev1] [--serve]
+'''
+
+import array
+import base64
+import json
+import math
+import sys
+
+FAKE_FREQ_HZ = 1000.0
+FAKE_SQUARE_WAVE_HZ = 1000.0
+FAKE_HIGH_VOLTAGE = 5.0
+
+
+class FakeNIDevice(object):
+    def __init__(self):
+        self._ports = {}
+
+    def measure_frequency(self):
+        return {"FREQ_HZ": FAKE_FREQ_HZ}
+
+    def read_byte(self, port):
+        return {"BYTEVAL": "0x%02X" % self._ports.get(port, 0)}
+
+    def write_byte(self, port, value):
+        self._ports[port] = int(value)
+        return {}
+
+    def acquire_samples(self, file, channel, rate, time):  # pylint: disable=W0622
+        levels = _square_wave(rate, time)
+        with open(file, "w") as samplefile:
+            samplefile.write("Time, %s\n" % channel)
+            for i, level in enumerate(levels):
+                samplefile.write("%f, %f\n" % (float(i) / rate, level))
+        return {"SAMPLES": len(levels)}
+
+    def stream_samples(self, channel, rate, time):  # pylint: disable=W0613,W0622
+        levels = _square_wave(rate, time)
+        if sys.byteorder != "little":
+            levels.byteswap()
+        return {"SAMPLES": base64.b64encode(levels.tostring())}
+
+
+def _square_wave(rate, time):  # pylint: disable=W0621
+    levels = array.array("d")
+    for i in xrange(int(rate * time)):
+        t = float(i) / rate
+        levels.append(FAKE_HIGH_VOLTAGE if math.modf(t * FAKE_SQUARE_WAVE_HZ)[0] < 0.5 else 0.0)
+    return levels
+
+
+def serve(device, stdin, stdout):
+    for line in iter(stdin.readline, ""):
+        request = json.loads(line)
+        try:
+            result = getattr(device, request["cmd"])(**request.get("args", {}))
+            response = {"id": request["id"], "result": result}
+        except Exception as the_exception:  # pylint: disable=W0703
+            response = {"id": request["id"], "error": str(the_exception)}
+        stdout.write(json.dumps(response) + "\n")
+        stdout.flush()
+
+
+if __name__ == '__main__':
+    serve(FakeNIDevice(), sys.stdin, sys.stdout)
@@ -0,0 +1,118 @@
+import argparse
+import struct
+
+import crc16
+import oven
+import serial
+
+# Runs a sub-zero ramp/soak profile with ProfileRunner and checks the oven settles at the negative setpoint.
+# Without an oven path it runs against FakeOvenPort, an in-memory Modbus controller whose PV follows the
+# setpoint:
+#     python -m tests.test_oven_profile [--oven /dev/ttyUSB0] [--target -40]
+
+FAKE_PV_REGISTER = oven.PROCESS_VALUE_REGISTER
+FAKE_SETPOINT_REGISTER = oven.SETPOINT_REGISTER
+FAKE_SETTLE_FRACTION = 0.5  # of the PV -> setpoint difference closed per PV read
+
+
+class FakeOvenPort(object):
+    # Enough of serial.Serial for Oven and ModbusRtuMaster: answers read holding registers (0x03) and write
+    # single register (0x06) for slave 1.
+    baudrate = 9600
+    bytesize = 8
+    parity = serial.PARITY_NONE
+    stopbits = 1
+
+    def __init__(self, *args, **kwargs):  # pylint: disable=W0613
+        self._registers = {FAKE_PV_REGISTER: 250, FAKE_SETPOINT_REGISTER: 250}
+        self._response = ''
+
+    def setBaudrate(self, baudrate):
+        self.baudrate = baudrate
+
+    def setTimeout(self, timeout):
+        pass
+
+    def setRtsCts(self, enable):
+        pass
+
+    def setXonXoff(self, enable):
+        pass
+
+    def flush(self):
+        pass
+
+    def flushInput(self):
+        self._response = ''
+
+    def close(self):
+        pass
+
+    def write(self, frame):
+        function_code = ord(frame[1])
+        address, value = struct.unpack('>HH', frame[2:6])
+        if function_code == 0x03:
+            self._settle()
+            data = ''.join(struct.pack('>H', self._registers.get(address + i, 0)) for i in xrange(value))
+            body = frame[:2] + chr(len(data)) + data
+        else:
+            self._registers[address] = value
+            body = frame[:6]
+        self._response = body + struct.pack('<H', crc16.calculate(body))
+
+    def read(self, size):
+        data, self._response = self._response[:size], self._response[size:]
+        return data
+
+    def _settle(self):
+        pv = _signed(self._registers[FAKE_PV_REGISTER])
+        setpoint = _signed(self._registers[FAKE_SETPOINT_REGISTER])
+        pv += int(round((setpoint - pv) * FAKE_SETTLE_FRACTION))
+        self._registers[FAKE_PV_REGISTER] = pv & 0xFFFF
+
+
+def _signed(value):
+    return value - 0x10000 if value & 0x8000 else value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="run a sub-zero profile on the oven driver")
+    parser.add_argument('--oven', '-o',
+                        default=None,
+                        help="Serial port of the oven, e.g. /dev/ttyUSB0 (default: in-memory fake)")
+    parser.add_argument('--target', '-t',
+                        default=-40.0,
+                        type=float,
+                        help="Sub-zero soak temperature in C")
+    parser.add_argument('--soak', '-s',
+                        default=1.0,
+                        type=float,
+                        help="Soak time in seconds once stable")
+    args = parser.parse_args()
+
+    if args.oven is None:
+        oven.serial.Serial = FakeOvenPort
+        sample_interval, stable_time, timeout = 0.01, 0.1, 10
+    else:
+        sample_interval, stable_time, timeout = oven.DEFAULT_SAMPLE_INTERVAL, oven.DEFAULT_SOAK_STABLE_TIME, 3600
+    if args.target >= 0:
+        raise Exception("Target must be below 0 C")
+
+    oven_device = oven.Oven(args.oven or 'fake')
+    try:
+        profile = [oven.Ramp(args.target), oven.Soak(args.soak, stable_time=stable_time, stable_timeout=timeout)]
+        runner = oven.ProfileRunner(oven_device, profile, sample_interval=sample_interval)
+        print("Running profile " + str(profile))
+        runner.run()
+        temperature = oven_device.read_temperature()
+        print("Soak waited {0:.1f} s for stability, PV now {1:.1f} C".format(runner.soak_wait_times[0],
+                                                                           temperature))
+        if abs(temperature - args.target) > oven.DEFAULT_SOAK_TOLERANCE:
+            raise Exception("PV {0} is not at the {1} C setpoint".format(temperature, args.target))
+    finally:
+        oven_device.close()
+    print("Done.")
+
+
+if __name__ == '__main__':
+    main()
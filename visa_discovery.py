@@ -0,0 +1,141 @@
+import threading
+import time
+
+import pyvisa.visa
+import visa_instrument
+
+# Cached VISA resource discovery.
+#
+# A viFindRsrc walk (ResourceManager.list_resources) can take seconds on GPIB/TCPIP, and our drivers only ever
+# needed it to find out which resource string the instrument with serial number X is on today.  This keeps the
+# last scan around: within DISCOVERY_TTL it's returned as is, after that the stale list is still returned right
+# away while a background thread rescans (stale-while-revalidate).
+#
+#   dmm = visa_discovery.open_by_serial("MY53204664", Agilent34461DMM)
+
+DISCOVERY_TTL = 60  # seconds
+# A serial number lookup that misses rescans, unless the list is younger than this (seconds).
+MISS_RESCAN_MIN_AGE = 5
+
+# Serial (ASRL) resources are skipped when building the IDN index: they may not be SCPI instruments at all,
+# and each one would cost a full read timeout.
+IDN_INDEX_EXCLUDED_PREFIXES = ("ASRL",)
+
+
+class DiscoveryError(Exception):
+    pass
+
+
+class ResourceDiscoveryCache(object):
+
+    def __init__(self, ttl=DISCOVERY_TTL, query='?*::INSTR'):
+        self.ttl = ttl
+        self._query = query
+        self._resources = None
+        self._scanned_at = None
+        self._refresh_thread = None
+        self._idn_index = {}     # resource name -> idn_info, None if it didn't answer *IDN?
+        self._lock = threading.Lock()
+
+    def list_resources(self, force_rescan=False):
+        with self._lock:
+            resources = self._resources
+            age = None if self._scanned_at is None else time.time() - self._scanned_at
+        if force_rescan or resources is None:
+            return self._rescan(retry_failed_probes=force_rescan)
+        if age > self.ttl:
+            self._start_background_refresh()
+        return resources
+
+    def invalidate(self):
+        with self._lock:
+            self._resources = None
+            self._scanned_at = None
+            self._idn_index = {}
+
+    def _rescan(self, retry_failed_probes=False):
+        # Resources that didn't answer *IDN? are only probed again after an explicit rescan
+        # (list_resources(force_rescan=True)), each probe costs a full VISA timeout.
+        resources = tuple(pyvisa.visa.ResourceManager().list_resources(self._query))
+        with self._lock:
+            self._resources = resources
+            self._scanned_at = time.time()
+            for resource_name, idn_info in self._idn_index.items():
+                # drop instruments that went away
+                if resource_name not in resources or (retry_failed_probes and idn_info is None):
+                    del self._idn_index[resource_name]
+        return resources
+
+    def _start_background_refresh(self):
+        with self._lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return
+            self._refresh_thread = threading.Thread(target=self._background_refresh, name="VisaDiscoveryRefresh")
+            self._refresh_thread.daemon = True
+            self._refresh_thread.start()
+
+    def _background_refresh(self):
+        try:
+            self._rescan()
+        except Exception:  # pylint: disable=W0703
+            # Keep serving the stale list, the next list_resources() tries again.
+            pass
+
+    #####################################################################
+    # IDN index: model/serial number -> resource name
+    #####################################################################
+
+    def _update_idn_index(self, resources):
+        for resource_name in resources:
+            if resource_name.upper().startswith(IDN_INDEX_EXCLUDED_PREFIXES):
+                continue
+            with self._lock:
+                if resource_name in self._idn_index:
+                    continue
+            try:
+                # Goes through the session pool, so the driver opened afterwards gets a warm session.
+                idn_info = visa_instrument.VisaInstrument(resource_name, do_selftest=False).idn_info
+            except Exception:  # pylint: disable=W0703
+                # Not something that answers *IDN?; remember that, and don't keep its session open.
+                visa_instrument.SESSION_POOL.discard(resource_name)
+                idn_info = None
+            with self._lock:
+                self._idn_index[resource_name] = idn_info
+
+    def idn_index(self):
+        # Returns {resource name: idn_info dict} for every instrument that answered *IDN?.
+        self._update_idn_index(self.list_resources())
+        with self._lock:
+            return dict((resource_name, idn_info) for resource_name, idn_info in self._idn_index.items()
+                        if idn_info is not None)
+
+    def find_resource_by_serial(self, serial_number):
+        for rescan in (False, True):
+            if rescan:
+                with self._lock:
+                    if time.time() - self._scanned_at < MISS_RESCAN_MIN_AGE:
+                        break
+                # Maybe it was just plugged in.  Only new resources get probed.
+                self._rescan()
+            for resource_name, idn_info in self.idn_index().items():
+                if idn_info['serial_number'].strip() == serial_number:
+                    return resource_name
+        raise DiscoveryError("No instrument with serial number [{0}] found".format(serial_number))
+
+    def find_resources_by_model(self, model):
+        return sorted(resource_name for resource_name, idn_info in self.idn_index().items()
+                      if idn_info['model'].strip().lower() == model.lower())
+
+
+DISCOVERY_CACHE = ResourceDiscoveryCache()
+
+
+def list_resources(force_rescan=False):
+    return DISCOVERY_CACHE.list_resources(force_rescan)
+
+
+def open_by_serial(serial_number, driver_class=visa_instrument.VisaInstrument, *args, **kwargs):
+    '''Instantiate driver_class for the instrument with the given serial number.
+    Extra arguments are passed on to the driver's constructor.
+    '''
+    return driver_class(DISCOVERY_CACHE.find_resource_by_serial(serial_number), *args, **kwargs)
@@ -1,5 +1,10 @@
 import pyvisa.visa
+import pyvisa.pyvisa.constants as visa_constants
+import pyvisa.pyvisa.util as visa_util
+import contextlib
 import re
+import threading
+import time
 
 # pylint: disable = R0904
 # SCPI instruments have lots of methods.... This might be a good global disable for this repo.
@@ -8,11 +13,86 @@ DO_DEBUG_PRINT = False
 
 TST_RE = re.compile(r"\+([01]{1})")
 
+# Drivers share one VISA session per resource across instances (see VisaSessionPool).
+USE_SESSION_POOL = True
+# How long (seconds) self-test, IDN and other cached query results stay valid for a pooled session.
+SESSION_POOL_TTL = 300
+
 
 class VisaError(Exception):
     pass
 
 
+class _PooledSession(object):
+    # One open pyvisa session plus query results cached for it.
+
+    def __init__(self, session):
+        self.session = session
+        self._cache = {}  # key -> (time stored, value)
+
+    def get(self, key, ttl):
+        if key not in self._cache:
+            return None
+        stored_at, value = self._cache[key]
+        if time.time() - stored_at > ttl:
+            del self._cache[key]
+            return None
+        return value
+
+    def set(self, key, value):
+        self._cache[key] = (time.time(), value)
+
+    def clear(self):
+        self._cache = {}
+
+
+class VisaSessionPool(object):
+    # Process-wide cache of open VISA sessions, keyed by resource name (and term chars).
+    # Test sequencers re-instantiate drivers for every DUT.  Opening a new session each time and re-running
+    # *TST? (up to 18s on the mux), *IDN? and friends is pure overhead, so the pool hands back the live session
+    # and the cached results while they're younger than ttl.
+
+    def __init__(self, ttl=SESSION_POOL_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get_session(self, resource_name, term_chars, timeout):
+        key = (resource_name, term_chars)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = _PooledSession(pyvisa.visa.instrument(resource_name, term_chars=term_chars, timeout=timeout))
+                self._entries[key] = entry
+            else:
+                # previous user may have changed it.
+                entry.session.timeout = timeout
+        return entry
+
+    def invalidate(self, resource_name=None):
+        # Forget cached query results (all resources if resource_name is None), but keep the sessions open.
+        with self._lock:
+            for (name, _), entry in self._entries.items():
+                if resource_name is None or name == resource_name:
+                    entry.clear()
+
+    def discard(self, resource_name):
+        # Close and forget the sessions for resource_name, e.g. after the instrument misbehaved.
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == resource_name]:
+                self._entries.pop(key).session.close()
+
+    def close_all(self):
+        with self._lock:
+            entries = self._entries.values()
+            self._entries = {}
+        for entry in entries:
+            entry.session.close()
+
+
+SESSION_POOL = VisaSessionPool()
+
+
 class VisaInstrument(object):
     # Class to implement the basics of an instrument.
     # This entails: VISA initialization basics
@@ -24,8 +104,25 @@ class VisaInstrument(object):
     # Basically keeping this to sending the core commands and returning the raw response for now.
     # using write/query here instead of write/read since query is used in the SCPI standard.
 
+    # Shadow state cache: send_command_and_check_error skips a command when the instrument is known to already
+    # have that setting.  Drivers opt in by listing the SCPI headers that are plain settings (no side effects,
+    # not changed by the instrument on its own -- so NOT things like OUTP, which protection can turn off).
+    _STATE_CACHE_HEADERS = ()
+    # Headers that select what the other settings apply to (e.g. INST:SEL on a multi-output supply).
+    # Their current values are part of the cache key of every other header.
+    _STATE_SCOPE_HEADERS = ()
+    # Anything starting with these may change settings behind our back: drop the whole cache.
+    # Drivers whose instrument reconfigures itself on other commands (e.g. MEAS?/CONF on a DMM) add them.
+    _STATE_RESET_PREFIXES = ("*RST", "*RCL", "SYST:PRES")
+
     def __init__(self, resource_name, term_chars="\n", do_selftest=True, timeout_arg = 5):
-        self._instrument = pyvisa.visa.instrument(resource_name, term_chars=term_chars, timeout = timeout_arg)
+        self._resource_name = resource_name
+        if USE_SESSION_POOL:
+            self._pooled_session = SESSION_POOL.get_session(resource_name, term_chars, timeout_arg)
+            self._instrument = self._pooled_session.session
+        else:
+            self._pooled_session = None
+            self._instrument = pyvisa.visa.instrument(resource_name, term_chars=term_chars, timeout = timeout_arg)
         # term_chars note:
         #   USB 34972 wants '\n'.  Is NOT happy if left to default of '\r\n'
         #   I put this in here as our default, but we may need to make it a bus-by-bus setting.
@@ -33,18 +130,107 @@ class VisaInstrument(object):
 
         self._no_error_string = "+0,\"No error\"\n"
 
-        if do_selftest:
+        # Commands queued by send_command_and_check_error while inside a batch() block.
+        # None means we're not batching and commands go out immediately.
+        self._batched_commands = None
+
+        self._state_cache = {}  # (scope values, header) -> last value successfully sent
+        self.state_cache_hits = 0
+        self.state_cache_misses = 0
+
+        # A warm pooled session has already passed self-test recently, no need to wait for it again.
+        if do_selftest and self._get_cached_value('self_test') is None:
             if (self.self_test() == "1"):
+                if self._pooled_session is not None:
+                    SESSION_POOL.discard(resource_name)
                 raise VisaError("self_test failed")
+            self._set_cached_value('self_test', "0")
 
         # member variables will get filled in when we run IDN.
         self.idn_info = {}
-        self.identification_query()
+        cached_idn_info = self._get_cached_value('idn_info')
+        if cached_idn_info is None:
+            self.identification_query()
+            self._set_cached_value('idn_info', dict(self.idn_info))
+        else:
+            self.idn_info = dict(cached_idn_info)
 
         if DO_DEBUG_PRINT:
             print "IDN"
             print self.idn_info
 
+    ##########################################################################################
+    # SESSION POOL CACHE
+    # Results of queries that don't change while the instrument stays connected (IDN, installed cards, ...)
+    ##########################################################################################
+    def _get_cached_value(self, key):
+        if self._pooled_session is None:
+            return None
+        return self._pooled_session.get(key, SESSION_POOL.ttl)
+
+    def _set_cached_value(self, key, value):
+        if self._pooled_session is not None:
+            self._pooled_session.set(key, value)
+
+    def cached_query(self, key, query_function):
+        # Return query_function()'s result, or its cached result from a previous driver instance on this session.
+        value = self._get_cached_value(key)
+        if value is None:
+            value = query_function()
+            self._set_cached_value(key, value)
+        return value
+
+    ##########################################################################################
+    # SHADOW STATE CACHE
+    ##########################################################################################
+    @classmethod
+    def _split_command(cls, command):
+        # "VOLT 5" -> ("VOLT", "5").  Header normalized to upper case without a leading colon.
+        fields = command.strip().split(None, 1)
+        if not fields:
+            return "", ""
+        header = fields[0].lstrip(':').upper()
+        value = fields[1].strip() if len(fields) > 1 else ""
+        return header, value
+
+    def _state_cache_key(self, header):
+        if header in self._STATE_SCOPE_HEADERS:
+            return ((), header)
+        if header not in self._STATE_CACHE_HEADERS:
+            return None
+        scope = tuple(self._state_cache.get(((), scope_header)) for scope_header in self._STATE_SCOPE_HEADERS)
+        return (scope, header)
+
+    def _note_outgoing_message(self, message, record=False):
+        # Called for everything we send, one ';'-separated command at a time and in order, since a scope header
+        # changes the key of the commands after it.  Messages that didn't go through send_command_and_check_error
+        # (record=False) have unknown effect: their entries are dropped.  record=True stores the sent values.
+        for command in message.split(';'):
+            if not self._state_cache and not record:
+                return
+            header, value = self._split_command(command)
+            if header.startswith(self._STATE_RESET_PREFIXES):
+                self.invalidate_state_cache()
+                continue
+            cache_key = self._state_cache_key(header)
+            if cache_key is None:
+                continue
+            if record:
+                self._state_cache[cache_key] = value
+            elif header in self._STATE_SCOPE_HEADERS:
+                # Scope unknown: no scoped entry can be trusted, including those recorded before any selection.
+                self._state_cache = dict((key, value) for key, value in self._state_cache.items() if key[0] == ())
+                self._state_cache.pop(cache_key, None)
+            else:
+                self._state_cache.pop(cache_key, None)
+
+    def invalidate_state_cache(self):
+        # Call this if the instrument may have been changed from somewhere else (front panel, other program).
+        self._state_cache = {}
+
+    def state_cache_stats(self):
+        return {'hits': self.state_cache_hits, 'misses': self.state_cache_misses, 'entries': len(self._state_cache)}
+
     ##########################################################################################
     # PYVISA INSTRUMENT INTERFACE
     #
@@ -71,34 +257,142 @@ class VisaInstrument(object):
         return reply
 
     def write(self, message):
+        self._note_outgoing_message(message)
+        return self._instrument.write(message)
+
+    def _write_recorded(self, message):
+        # For send_command_and_check_error: the cache is updated by the caller once the command is known to
+        # have gone through.
         return self._instrument.write(message)
 
     def read_raw(self):
         return self._instrument.read_raw()
 
-    def read_values(self):
-        return self._instrument.read_values()
+    def read_into(self, buffer, offset=0):
+        # Reuse one bytearray across acquisitions instead of allocating a new string per read.
+        return self._instrument.read_into(buffer, offset)
+
+    def read_values(self, container=list):
+        return self._instrument.read_values(container=container)
 
     def read_value(self):
         return self._instrument.read_values()[0]
 
+    def read_binary_values(self, is_single=False, is_big_endian=True):
+        # Reads an IEEE-488.2 block of REAL,64 (or REAL,32) values into an array.array.
+        # Default byte order is big-endian, which is what SCPI FORM:BORD NORM gives us.
+        # Term char has to be off, or the read stops at the first 0x0A byte in the data.
+        termchar_enabled = self._instrument.get_visa_attribute(visa_constants.VI_ATTR_TERMCHAR_EN)
+        self._instrument.set_visa_attribute(visa_constants.VI_ATTR_TERMCHAR_EN, visa_constants.VI_FALSE)
+        try:
+            data = self.read_raw()
+        finally:
+            self._instrument.set_visa_attribute(visa_constants.VI_ATTR_TERMCHAR_EN, termchar_enabled)
+        try:
+            return visa_util.parse_binary_array(data, is_big_endian=is_big_endian, is_single=is_single)
+        except ValueError as error:
+            raise VisaError("Bad binary block from instrument: " + str(error))
+
     def ask(self, message):
+        self._note_outgoing_message(message)
         return self._instrument.ask(message)
 
-    def ask_for_values(self, message):
-        return self._instrument.ask_for_values(message)
+    def ask_for_values(self, message, container=list):
+        self._note_outgoing_message(message)
+        return self._instrument.ask_for_values(message, container=container)
 
     def ask_for_value(self, message):
+        self._note_outgoing_message(message)
         return self._instrument.ask_for_values(message)[0]
 
+    def ask_for_binary_values(self, message, is_single=False, is_big_endian=True):
+        self.write(message)
+        return self.read_binary_values(is_single=is_single, is_big_endian=is_big_endian)
+
     def send_command_and_check_error(self, command):
         # method to check for errors after sending command. WILL NOT WORK WITH QUERIES!
-        self.write(command)
+        header, value = self._split_command(command)
+        cache_key = self._state_cache_key(header)
+        if cache_key is not None:
+            if self._state_cache.get(cache_key) == value:
+                self.state_cache_hits += 1
+                return 0
+            self.state_cache_misses += 1
+
+        if self._batched_commands is not None:
+            # Inside a batch() block: errors get checked when the batch is flushed.
+            # (A failing batch clears the state cache, so it's fine to record the value now, which lets later
+            # commands of the batch hit it.)
+            self._batched_commands.append(command)
+            self._note_outgoing_message(command, record=True)
+            return 0
+        self._write_recorded(command)
         result = self.event_status_register_query()
         if result:
+            self.invalidate_state_cache()
             raise VisaError("Error in command:" + command + " error: " + str(result))
+        self._note_outgoing_message(command, record=True)
         return result
 
+    @contextlib.contextmanager
+    def batch(self):
+        '''Queue up send_command_and_check_error calls and send them as one program message.
+
+        Each queued command is followed by *ESR? in the same message, e.g.
+            :TRIG:DEL 0;*ESR?;:SAMP:COUN 10;*ESR?
+        so the whole batch costs one write and one read, but an error can still be traced
+        back to the command that caused it.  Only commands (no queries!) can be batched.
+
+            with dmm.batch():
+                dmm.set_measurement_func(dmm.CURRENT_DC)
+                dmm.set_current_range(0.1)
+        '''
+        if self._batched_commands is not None:
+            # Nested batch: just keep adding to the outer one.
+            yield
+            return
+        self._batched_commands = []
+        try:
+            yield
+            commands = self._batched_commands
+        except:
+            # Nothing was sent, but values were already recorded in the state cache.
+            self.invalidate_state_cache()
+            raise
+        finally:
+            self._batched_commands = None
+        try:
+            self._send_batched_commands(commands)
+        except:
+            self.invalidate_state_cache()
+            raise
+
+    def _send_batched_commands(self, commands):
+        if not commands:
+            return
+        program_message = []
+        for command in commands:
+            # Without the leading colon, a header after ';' is relative to the previous command's subsystem.
+            if not command.startswith(('*', ':')):
+                command = ':' + command
+            program_message.append(command + ";*ESR?")
+        program_message = ';'.join(program_message)
+        self._write_recorded(program_message)
+        # Same values as recorded while queueing, replayed command by command so scope changes key what follows.
+        self._note_outgoing_message(program_message, record=True)
+        esr_results = self.read().strip().split(';')
+        if len(esr_results) != len(commands):
+            raise VisaError("Expected {0} *ESR? replies to batch, got: {1}".format(len(commands), esr_results))
+
+        for command, result in zip(commands, esr_results):
+            result = int(result)
+            if result:
+                # Anything after the failing command was still executed by the instrument.
+                error_code, message = self.error_query()
+                self.clear_error_stack()
+                raise VisaError("Error in command:" + command + " error: " + str(result) +
+                                " ({0},{1})".format(error_code, message.strip()))
+
     def clear_status(self):
         return self.send_command_and_check_error("*CLS")
 